@@ -0,0 +1,337 @@
+import asyncio
+import atexit
+import threading
+from functools import partial
+from http import HTTPStatus
+from time import monotonic
+from types import SimpleNamespace
+
+import aiohttp
+from flask import current_app
+
+from api.client import (
+    CALLER_ERRORS, IP_ENDPOINT, METADATA_ENDPOINT, Auth0SignalsClient,
+    handle_error_response
+)
+from api.errors import Auth0SSLError, DeadlineExceededError
+from api.utils import join_url, load_json
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def run_coroutine(coroutine):
+    """
+    Run the coroutine on the process-wide event loop and wait for its result.
+
+    The loop runs in a daemon thread for the lifetime of the process, so the
+    connections opened on it are reused across the requests.
+    """
+
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, daemon=True).start()
+            atexit.register(stop_event_loop)
+
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
+
+
+def stop_event_loop():
+    """
+    Close the process-wide asynchronous session, if any, along with its
+    connections, then stop the process-wide event loop.
+    """
+
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            return
+
+        if _async_session is not None and not _async_session.closed:
+            asyncio.run_coroutine_threadsafe(
+                _async_session.close(), _loop
+            ).result()
+        _loop.call_soon_threadsafe(_loop.stop)
+        _loop = None
+
+
+class AsyncSingleFlight:
+    """
+    Same as `api.cache.SingleFlight`, but for the coroutines run on the
+    process-wide event loop. It is only ever used from the loop, so it
+    needs no lock.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    async def do(self, key, coroutine_function, *args, deadline=None,
+                 caller_errors=()):
+        """
+        Return the result of the call, waiting for the one already in
+        flight with the same key, if any, until the monotonic deadline
+        of the caller, past which `asyncio.TimeoutError` is raised.
+        """
+
+        while key in self._futures:
+            future = self._futures[key]
+            timeout = None if deadline is None else max(
+                deadline - monotonic(), 0
+            )
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(future), timeout
+                )
+            except caller_errors:
+                continue
+            except asyncio.CancelledError:
+                # The call was cancelled, not the caller waiting on it.
+                if future.cancelled():
+                    continue
+                raise
+
+        future = self._futures[key] = \
+            asyncio.get_event_loop().create_future()
+        try:
+            result = await coroutine_function(*args)
+        except asyncio.CancelledError:
+            del self._futures[key]
+            future.cancel()
+            raise
+        except BaseException as error:
+            del self._futures[key]
+            future.set_exception(error)
+            # Nobody may be waiting on it, which is not worth a warning.
+            future.exception()
+            raise
+
+        del self._futures[key]
+        future.set_result(result)
+        return result
+
+
+reputation_flights = AsyncSingleFlight()
+metadata_flights = AsyncSingleFlight()
+
+
+_async_session = None
+
+
+async def get_async_session(pool_size, keepalive, user_agent):
+    """
+    Return the process-wide asynchronous session, creating it on the first
+    call. It is only ever used from the process-wide event loop.
+    """
+
+    global _async_session
+
+    if _async_session is None or _async_session.closed:
+        _async_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=pool_size, keepalive_timeout=keepalive
+            ),
+            headers={
+                'Accept': 'application/json',
+                'User-Agent': user_agent
+            }
+        )
+
+    return _async_session
+
+
+class AsyncAuth0SignalsClient(Auth0SignalsClient):
+    """
+    Auth0 Signals client keeping all of its upstream requests in flight
+    at once on the process-wide event loop.
+
+    It exposes the same synchronous interface as its parent, so the routes
+    drive it the same way, only the network layer is asynchronous.
+    """
+
+    def __init__(self, token, deadline=None):
+        super().__init__(token, deadline)
+        self.concurrency_limit = \
+            current_app.config['ASYNC_CONCURRENCY_LIMIT']
+        self.keepalive = current_app.config['HTTP_KEEPALIVE']
+        self.user_agent = current_app.config['USER_AGENT']
+
+    async def _send_once(self, url, timeouts):
+        session = await get_async_session(
+            self.concurrency_limit, self.keepalive, self.user_agent
+        )
+        connect_timeout, read_timeout = timeouts
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        try:
+            async with session.get(
+                    url, headers=self.headers, timeout=timeout
+            ) as response:
+                text = await response.text()
+                return SimpleNamespace(
+                    ok=response.status < HTTPStatus.BAD_REQUEST,
+                    status_code=response.status,
+                    reason=response.reason,
+                    headers=response.headers,
+                    text=text,
+                    json=partial(load_json, text)
+                )
+        except aiohttp.ClientSSLError as error:
+            raise Auth0SSLError(error)
+
+    async def _attempt(self, url, endpoint):
+        timeouts = self._get_timeouts()
+        started_at = self._enter_circuit(endpoint)
+
+        failed = True
+        try:
+            response = await self._send_once(url, timeouts)
+            failed = self._is_server_error(response)
+            return response
+        finally:
+            self._exit_circuit(endpoint, started_at, failed)
+
+    async def _send(self, url, endpoint):
+        attempt = partial(self._attempt, url, endpoint)
+        hedger = self.hedgers.get(endpoint)
+        if hedger is None:
+            return await attempt()
+        return await hedger.run_async(attempt, reserve=self._reserve_hedge)
+
+    async def _request(self, url, endpoint):
+        rate_limited = failures = 0
+
+        while True:
+            await asyncio.sleep(self._reserve_request())
+
+            try:
+                response = await self._send(url, endpoint)
+            except Auth0SSLError:
+                raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                response = None
+
+            if response is None:
+                failures += 1
+                delay = self._get_retry_delay(failures)
+                if delay is None:
+                    raise self._get_failure_error()
+                await asyncio.sleep(delay)
+                continue
+
+            if (self._is_rate_limited(response)
+                    and rate_limited < self.rate_limit_retries):
+                rate_limited += 1
+                continue
+
+            if self._is_server_error(response):
+                failures += 1
+                delay = self._get_retry_delay(failures)
+                if delay is not None:
+                    await asyncio.sleep(delay)
+                    continue
+
+            return response
+
+    async def _get_async(self, url):
+        response = await self._request(url, IP_ENDPOINT)
+
+        if response.ok:
+            return response.json()
+
+        return handle_error_response(response)
+
+    async def _coalesce(self, flights, key, coroutine_function, *args):
+        try:
+            return await flights.do(
+                key, coroutine_function, *args, deadline=self.deadline,
+                caller_errors=CALLER_ERRORS
+            )
+        except asyncio.TimeoutError:
+            raise DeadlineExceededError()
+
+    async def fetch_auth0_response(self, observable):
+        key = (self.token_hash, observable['value'])
+
+        response_data = self._get_cached(self.reputation_cache, key)
+        if response_data is not None:
+            return response_data
+
+        return await self._coalesce(
+            reputation_flights, key, self._fetch_auth0_response, key,
+            observable['value']
+        )
+
+    async def _fetch_auth0_response(self, key, value):
+        return self._keep_reputation(
+            key, await self._get_async(self._get_reputation_url(value))
+        )
+
+    async def fetch_details_of_the_list(self, blocklist_type, blocklist_id):
+        key = (blocklist_type, blocklist_id)
+
+        details = self._get_cached(self.metadata_cache, key)
+        if details is not None:
+            return details
+
+        return await self._coalesce(
+            metadata_flights, key, self._fetch_details_of_the_list, key
+        )
+
+    async def _fetch_details_of_the_list(self, key):
+        response = await self._request(
+            self._get_details_url(key), METADATA_ENDPOINT
+        )
+        if not response.ok:
+            return response.json()
+
+        return self._keep_details(key, response.json())
+
+    async def _gather(self, coroutines):
+        semaphore = asyncio.Semaphore(self.concurrency_limit)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(
+            *map(bounded, coroutines), return_exceptions=True
+        )
+
+    def get_auth0_response(self, observable):
+        return run_coroutine(self.fetch_auth0_response(observable))
+
+    def get_auth0_responses(self, observables):
+        results = run_coroutine(self._gather(
+            self.fetch_auth0_response(observable)
+            for observable in observables
+        ))
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            yield result
+
+    def check_health(self):
+        url = join_url(self.api_url, 'v2.0', 'ip')
+        return run_coroutine(self._get_async(url))
+
+    def get_details_of_the_list(self, blocklist_type, blocklist_id):
+        return run_coroutine(
+            self.fetch_details_of_the_list(blocklist_type, blocklist_id)
+        )
+
+    def get_details_of_the_lists(self, blocklists):
+        blocklists = list(dict.fromkeys(blocklists))
+        results = run_coroutine(self._gather(
+            self.fetch_details_of_the_list(*blocklist)
+            for blocklist in blocklists
+        ))
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return dict(zip(blocklists, results))
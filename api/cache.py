@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from time import monotonic
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after a time to live.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires_at <= monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+
+        with self._lock:
+            self._data[key] = (monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self)}
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls made with the same key into a single call,
+    whose result or error is shared by all of the callers waiting on it.
+
+    The errors bound to the caller making the call, such as its own
+    deadline being exceeded, are not shared: the callers waiting on it
+    make the call again instead, one of them in turn leading the others.
+    """
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, deadline=None, caller_errors=()):
+        """
+        Return the result of the call, waiting for the one already in
+        flight with the same key, if any, until the monotonic deadline
+        of the caller, past which `concurrent.futures.TimeoutError` is
+        raised.
+        """
+
+        while True:
+            with self._lock:
+                future = self._futures.get(key)
+                is_leader = future is None
+                if is_leader:
+                    future = self._futures[key] = Future()
+
+            if is_leader:
+                break
+
+            timeout = None if deadline is None else max(
+                deadline - monotonic(), 0
+            )
+            try:
+                return future.result(timeout)
+            except caller_errors:
+                continue
+
+        try:
+            result = func(*args)
+        except BaseException as error:
+            self._forget(key)
+            future.set_exception(error)
+            raise
+
+        self._forget(key)
+        future.set_result(result)
+        return result
+
+    def _forget(self, key):
+        with self._lock:
+            del self._futures[key]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, maxsize, ttl):
+    """
+    Return the process-wide cache registered under the name.
+
+    The cache is created on the first call, so its size and TTL are taken
+    from that call and stay the same for the lifetime of the process.
+    """
+
+    with _caches_lock:
+        if name not in _caches:
+            _caches[name] = TTLCache(maxsize, ttl)
+        return _caches[name]
+
+
+def get_cache_stats(*names):
+    with _caches_lock:
+        return {name: _caches[name].stats for name in names
+                if name in _caches}
+
+
+def clear_caches():
+    with _caches_lock:
+        for cache in _caches.values():
+            cache.clear()
@@ -1,10 +1,29 @@
-import requests
+import socket
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import partial
+from hashlib import sha256
 from http import HTTPStatus
+from http.cookiejar import DefaultCookiePolicy
+from random import uniform
+from time import monotonic, sleep
 
+import requests
 from flask import current_app
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 
-from api.errors import CriticalError, AuthorizationError
-from api.utils import join_url, ssl_error_handler
+from api.cache import SingleFlight, get_cache
+from api.errors import (
+    CriticalError, AuthorizationError, TooManyRequestsError,
+    Auth0ConnectionError, DeadlineExceededError, CircuitOpenError
+)
+from api.resilience import (
+    get_circuit_breaker, get_hedger, get_retry_after, get_token_bucket
+)
+from api.utils import (
+    join_url, load_json, map_concurrently, ssl_error_handler
+)
 
 
 POTENTIALLY_NOT_CRITICAL_ERRORS = (
@@ -12,73 +31,517 @@ POTENTIALLY_NOT_CRITICAL_ERRORS = (
 )
 INVALID_TOKEN_MESSAGE = 'Token must be a valid RFC4122 UUID'
 
+IP_ENDPOINT = 'v2.0/ip'
+METADATA_ENDPOINT = 'metadata'
+
+BLOCKLIST_DETAILS_FIELDS = (
+    'name', 'source', 'site', 'sensitivity', 'visibility', 'description',
+    'tags'
+)
+
+
+def handle_error_response(response):
+    """
+    Map an unsuccessful Auth0 Signals response to the corresponding error,
+    the potentially not critical ones result in an empty response instead.
+    """
+
+    if response.status_code in POTENTIALLY_NOT_CRITICAL_ERRORS:
+        if INVALID_TOKEN_MESSAGE in response.text:
+            raise AuthorizationError(INVALID_TOKEN_MESSAGE)
+        return []
+    elif response.status_code == HTTPStatus.UNAUTHORIZED:
+        raise AuthorizationError(response.text)
+
+    raise CriticalError(response)
+
+
+def project_reputation(payload, score_categories):
+    """
+    Project the reputation of an IP down to the overall score, the scores
+    of the given categories and the (blocklist_type, blocklist_id) pairs
+    it references, dropping the rest of the report (geo, history, ...).
+    """
+
+    fullip = payload['fullip']
+    domain = fullip['baddomain']['domain']
+    return {
+        'score': int(fullip['score']),
+        'scores': {category: int(fullip[category]['score'])
+                   for category in score_categories},
+        'blocklists': (
+            *(('badip', list_id) for list_id in fullip['badip']['blacklists']),
+            *(('baddomain', list_id)
+              for list_id in [*domain.get('blacklist', []),
+                              *domain.get('blacklist_mx', []),
+                              *domain.get('blacklist_ns', [])])
+        )
+    }
+
+
+def project_details(details):
+    return {field: details[field] for field in BLOCKLIST_DETAILS_FIELDS}
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """
+    HTTP adapter enabling TCP keep-alive on the pooled connections,
+    so idle connections survive between warm invocations.
+    """
+
+    def __init__(self, keepalive, **kwargs):
+        self.keepalive = keepalive
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        socket_options = [
+            *HTTPConnection.default_socket_options,
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            socket_options.append(
+                (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive)
+            )
+        kwargs['socket_options'] = socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+# Identical upstream lookups in flight at the same time across all the
+# requests served by the process are made only once.
+reputation_flights = SingleFlight()
+metadata_flights = SingleFlight()
+
+# The errors bound to the client making a coalesced lookup, which the
+# other clients waiting on it do not inherit.
+CALLER_ERRORS = (TooManyRequestsError, DeadlineExceededError)
+
+
+def get_session():
+    """
+    Return the process-wide session, creating it on the first call.
+
+    The session is shared across requests and threads, so it only holds
+    the headers common to all of them, the credentials are passed along
+    with each request instead. It keeps no cookies, so none set upstream
+    for one API key are ever sent along with the requests of another.
+    """
+
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+            session.headers.update({
+                'Accept': 'application/json',
+                'User-Agent': current_app.config['USER_AGENT']
+            })
+            adapter = KeepAliveAdapter(
+                current_app.config['HTTP_KEEPALIVE'],
+                pool_connections=1,
+                pool_maxsize=current_app.config['HTTP_POOL_SIZE']
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+
+    return _session
+
+
+def create_client(token, deadline=None):
+    if current_app.config['CLIENT_ENGINE'] == 'async':
+        # Only loaded when enabled, since aiohttp is slow to import.
+        from api.async_client import AsyncAuth0SignalsClient
+        return AsyncAuth0SignalsClient(token, deadline)
+    return Auth0SignalsClient(token, deadline)
+
 
 class Auth0SignalsClient:
-    def __init__(self, token):
+    def __init__(self, token, deadline=None):
         self.api_url = current_app.config['API_URL']
-        self.headers = {
-            'Accept': 'application/json',
-            'X-Auth-Token': token,
-            'User-Agent': current_app.config['USER_AGENT']
-        }
+        # The monotonic time by which all of the requests must be done.
+        self.deadline = deadline
+        self.connect_timeout = current_app.config['HTTP_CONNECT_TIMEOUT']
+        self.read_timeout = current_app.config['HTTP_READ_TIMEOUT']
+        self.retries = current_app.config['HTTP_RETRIES']
+        self.retry_backoff = current_app.config['HTTP_RETRY_BACKOFF']
+        self.session = get_session()
+        self.headers = {'X-Auth-Token': token}
         self.limit = current_app.config['CTR_ENTITIES_LIMIT']
+        # The categories scored by the judgements, kept by the projection.
+        self.score_categories = tuple(current_app.config['REASON_MAPPING'])
+        self.concurrency_limit = current_app.config['CTR_CONCURRENCY_LIMIT']
+        self.metadata_cache = (
+            get_cache(
+                'metadata',
+                current_app.config['METADATA_CACHE_SIZE'],
+                current_app.config['METADATA_CACHE_TTL']
+            )
+            if current_app.config['METADATA_CACHE_ENABLED'] else None
+        )
+        self.reputation_cache = (
+            get_cache(
+                'reputation',
+                current_app.config['REPUTATION_CACHE_SIZE'],
+                current_app.config['REPUTATION_CACHE_TTL']
+            )
+            if current_app.config['REPUTATION_CACHE_ENABLED'] else None
+        )
+        self.reputation_negative_ttl = \
+            current_app.config['REPUTATION_CACHE_NEGATIVE_TTL']
+        # Cached results are bound to the API key they were fetched with,
+        # but only its hash is kept in memory.
+        self.token_hash = sha256(token.encode()).hexdigest()
+        self.rate_limiter = (
+            get_token_bucket(
+                self.token_hash,
+                current_app.config['RATE_LIMIT_RATE'],
+                current_app.config['RATE_LIMIT_BURST']
+            )
+            if current_app.config['RATE_LIMIT_ENABLED'] else None
+        )
+        self.rate_limit_max_wait = current_app.config['RATE_LIMIT_MAX_WAIT']
+        self.rate_limit_retries = current_app.config['RATE_LIMIT_RETRIES']
+        self.circuit_breakers = (
+            {
+                endpoint: get_circuit_breaker(
+                    endpoint,
+                    error_rate=current_app.config[
+                        'CIRCUIT_BREAKER_ERROR_RATE'
+                    ],
+                    latency=current_app.config['CIRCUIT_BREAKER_LATENCY'],
+                    window=current_app.config['CIRCUIT_BREAKER_WINDOW'],
+                    min_calls=current_app.config['CIRCUIT_BREAKER_MIN_CALLS'],
+                    reset_timeout=current_app.config[
+                        'CIRCUIT_BREAKER_RESET_TIMEOUT'
+                    ]
+                )
+                for endpoint in (IP_ENDPOINT, METADATA_ENDPOINT)
+            }
+            if current_app.config['CIRCUIT_BREAKER_ENABLED'] else {}
+        )
+        self.hedgers = (
+            {
+                endpoint: get_hedger(
+                    endpoint,
+                    percentile=current_app.config['HEDGING_PERCENTILE'],
+                    max_rate=current_app.config['HEDGING_MAX_RATE'],
+                    min_samples=current_app.config['HEDGING_MIN_SAMPLES'],
+                    # Room for a call and its hedge from each of the
+                    # threads allowed at once.
+                    max_workers=2 * current_app.config[
+                        'CTR_CONCURRENCY_LIMIT'
+                    ]
+                )
+                for endpoint in (IP_ENDPOINT, METADATA_ENDPOINT)
+            }
+            if current_app.config['HEDGING_ENABLED'] else {}
+        )
+
+    def _reserve_request(self):
+        """
+        Return how long to wait before the next request to stay within the
+        rate limit of the API key.
+        """
+
+        if self.rate_limiter is None:
+            return 0
+
+        delay = self.rate_limiter.reserve(self.rate_limit_max_wait)
+        if delay is None:
+            raise TooManyRequestsError()
+        if self.deadline is not None and monotonic() + delay > self.deadline:
+            raise DeadlineExceededError()
+        return delay
+
+    def _reserve_hedge(self):
+        """
+        Tell whether a hedge may be sent right away within the rate limit
+        of the API key, taking a token for it if so.
+        """
+
+        return (self.rate_limiter is None
+                or self.rate_limiter.reserve(0) is not None)
+
+    def _get_timeouts(self):
+        """
+        Return the connect and read timeouts of the next request, cut down
+        to the time left until the deadline.
+        """
+
+        if self.deadline is None:
+            return self.connect_timeout, self.read_timeout
+
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError()
+        return (min(self.connect_timeout, remaining),
+                min(self.read_timeout, remaining))
+
+    def _get_retry_delay(self, failures):
+        """
+        Return how long to wait before sending a failed request again,
+        following an exponential backoff with full jitter, or None if
+        it must not be retried.
+        """
+
+        if failures > self.retries:
+            return None
+
+        delay = uniform(0, self.retry_backoff * 2 ** (failures - 1))
+        if self.deadline is not None and monotonic() + delay > self.deadline:
+            return None
+        return delay
+
+    def _get_failure_error(self):
+        if self.deadline is not None and monotonic() >= self.deadline:
+            return DeadlineExceededError()
+        return Auth0ConnectionError()
+
+    def _enter_circuit(self, endpoint):
+        """
+        Fail fast while the circuit breaker of the endpoint family is open,
+        otherwise return the time the call starts at.
+        """
+
+        circuit_breaker = self.circuit_breakers.get(endpoint)
+        if circuit_breaker is not None and not circuit_breaker.allow():
+            raise CircuitOpenError(endpoint)
+        return monotonic()
+
+    def _exit_circuit(self, endpoint, started_at, failed):
+        circuit_breaker = self.circuit_breakers.get(endpoint)
+        if circuit_breaker is not None:
+            circuit_breaker.record(failed, monotonic() - started_at)
+
+    @staticmethod
+    def _is_server_error(response):
+        return (not response.ok
+                and response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    def _is_rate_limited(self, response):
+        """
+        Align the rate limiter with the response and tell whether the
+        request was rejected, in which case the limiter backs off.
+        """
+
+        if self.rate_limiter is None:
+            return False
+
+        self.rate_limiter.update(response.headers)
+
+        if response.status_code != HTTPStatus.TOO_MANY_REQUESTS:
+            return False
+
+        self.rate_limiter.pause(get_retry_after(response.headers, 1))
+        return True
+
+    def _attempt(self, url, endpoint):
+        """
+        Make a single call, with the timeouts left and timed by the circuit
+        breaker from the time it actually starts, since a hedged call may
+        first wait for a worker.
+        """
+
+        timeouts = self._get_timeouts()
+        started_at = self._enter_circuit(endpoint)
+
+        # Whatever the call raises counts as a failure, so that
+        # a half-open circuit breaker is never left probing.
+        failed = True
+        try:
+            response = self.session.get(
+                url, headers=self.headers, timeout=timeouts
+            )
+            failed = self._is_server_error(response)
+            return response
+        finally:
+            self._exit_circuit(endpoint, started_at, failed)
+
+    def _send(self, url, endpoint):
+        attempt = partial(self._attempt, url, endpoint)
+        hedger = self.hedgers.get(endpoint)
+        if hedger is None:
+            return attempt()
+
+        try:
+            return hedger.run(
+                attempt, reserve=self._reserve_hedge, deadline=self.deadline
+            )
+        except FutureTimeoutError:
+            raise DeadlineExceededError()
+
+    def _request(self, url, endpoint):
+        rate_limited = failures = 0
+
+        while True:
+            sleep(self._reserve_request())
+
+            try:
+                response = self._send(url, endpoint)
+            except requests.exceptions.SSLError:
+                raise
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                response = None
+
+            if response is None:
+                failures += 1
+                delay = self._get_retry_delay(failures)
+                if delay is None:
+                    raise self._get_failure_error()
+                sleep(delay)
+                continue
+
+            if (self._is_rate_limited(response)
+                    and rate_limited < self.rate_limit_retries):
+                rate_limited += 1
+                continue
+
+            if self._is_server_error(response):
+                failures += 1
+                delay = self._get_retry_delay(failures)
+                if delay is not None:
+                    sleep(delay)
+                    continue
+
+            return response
+
+    def _coalesce(self, flights, key, func, *args):
+        """
+        Make the call, or wait for the identical one already in flight,
+        within the deadline of this client. The rate limit and deadline
+        errors of another client making the call are not inherited.
+        """
+
+        try:
+            return flights.do(
+                key, func, *args, deadline=self.deadline,
+                caller_errors=CALLER_ERRORS
+            )
+        except FutureTimeoutError:
+            raise DeadlineExceededError()
 
     @ssl_error_handler
     def _get(self, url):
-        response = requests.get(url, headers=self.headers)
+        response = self._request(url, IP_ENDPOINT)
 
         if response.ok:
-            return response.json()
+            return load_json(response.content)
+
+        return handle_error_response(response)
+
+    @staticmethod
+    def _get_cached(cache, key):
+        return None if cache is None else cache.get(key)
+
+    def _get_reputation_url(self, value):
+        return join_url(self.api_url, 'v2.0', 'ip', value)
+
+    def _keep_reputation(self, key, response_data):
+        """
+        Project the reputation fetched upstream and cache it, the empty one
+        for a shorter time.
+        """
 
-        if response.status_code in POTENTIALLY_NOT_CRITICAL_ERRORS:
-            if INVALID_TOKEN_MESSAGE in response.text:
-                raise AuthorizationError(INVALID_TOKEN_MESSAGE)
-            return []
-        elif response.status_code == HTTPStatus.UNAUTHORIZED:
-            raise AuthorizationError(response.text)
+        if response_data:
+            response_data = project_reputation(
+                response_data, self.score_categories
+            )
 
-        raise CriticalError(response)
+        if self.reputation_cache is not None:
+            self.reputation_cache.set(
+                key, response_data,
+                ttl=None if response_data else self.reputation_negative_ttl
+            )
+
+        return response_data
 
     def get_auth0_response(self, observable):
-        url = join_url(self.api_url, 'v2.0', 'ip', observable['value'])
-        return self._get(url)
+        key = (self.token_hash, observable['value'])
+
+        response_data = self._get_cached(self.reputation_cache, key)
+        if response_data is not None:
+            return response_data
+
+        return self._coalesce(
+            reputation_flights, key, self._fetch_auth0_response, key,
+            observable['value']
+        )
+
+    def _fetch_auth0_response(self, key, value):
+        return self._keep_reputation(
+            key, self._get(self._get_reputation_url(value))
+        )
+
+    def get_auth0_responses(self, observables):
+        return map_concurrently(
+            self.get_auth0_response, observables, self.concurrency_limit
+        )
 
     def check_health(self):
         url = join_url(self.api_url, 'v2.0', 'ip')
         return self._get(url)
 
+    def _get_details_url(self, key):
+        blocklist_type, blocklist_id = key
+        return join_url(
+            self.api_url, 'metadata', blocklist_type, 'lists', blocklist_id
+        )
+
+    def _keep_details(self, key, details):
+        details = project_details(details)
+
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(key, details)
+
+        return details
+
     @ssl_error_handler
     def get_details_of_the_list(self, blocklist_type, blocklist_id):
-        url = join_url(
-            self.api_url, 'metadata', blocklist_type, 'lists', blocklist_id
+        key = (blocklist_type, blocklist_id)
+
+        details = self._get_cached(self.metadata_cache, key)
+        if details is not None:
+            return details
+
+        return self._coalesce(
+            metadata_flights, key, self._fetch_details_of_the_list, key
         )
-        response = requests.get(url, headers=self.headers)
-        return response.json()
 
-    def get_full_details(self, response_data):
-        result = []
-        blocklists = {
-            'badip': response_data['fullip']['badip']['blacklists'],
-            'baddomain':
-                [
-                    *response_data['fullip']['baddomain']['domain'].get(
-                        'blacklist', []
-                    ),
-                    *response_data['fullip']['baddomain']['domain'].get(
-                        'blacklist_mx', []
-                    ),
-                    *response_data['fullip']['baddomain']['domain'].get(
-                        'blacklist_ns', []
-                    )
-                ]
-        }
-
-        for blocklist_type, blocklist_ids in blocklists.items():
-            for list_id in blocklist_ids:
-                result.append(
-                    self.get_details_of_the_list(blocklist_type, list_id)
-                )
-                if len(result) == self.limit:
-                    return result
+    def _fetch_details_of_the_list(self, key):
+        response = self._request(self._get_details_url(key), METADATA_ENDPOINT)
+        if not response.ok:
+            return response.json()
 
-        return result
+        return self._keep_details(key, load_json(response.content))
+
+    def get_blocklists(self, response_data):
+        """
+        Return the (blocklist_type, blocklist_id) pairs referenced by the
+        response in the order they are reported, up to the entities limit.
+        """
+
+        return list(response_data['blocklists'][:self.limit])
+
+    def get_details_of_the_lists(self, blocklists):
+        """
+        Fetch the details of each distinct blocklist once and return them
+        mapped by their (blocklist_type, blocklist_id) pairs.
+        """
+
+        blocklists = list(dict.fromkeys(blocklists))
+        return dict(zip(blocklists, map_concurrently(
+            lambda blocklist: self.get_details_of_the_list(*blocklist),
+            blocklists, self.concurrency_limit
+        )))
+
+    def get_full_details(self, response_data):
+        # Every blocklist yields exactly one document, so no requests are
+        # issued beyond the entities limit.
+        blocklists = self.get_blocklists(response_data)
+        details = self.get_details_of_the_lists(blocklists)
+        return [details[blocklist] for blocklist in blocklists]
@@ -1,171 +1,181 @@
-from functools import partial
-from datetime import datetime
-from uuid import uuid4, uuid5
+from functools import lru_cache, partial
+from time import monotonic
+
+from flask import (
+    Blueprint, Response, current_app, g, request, stream_with_context
+)
+
+from api.entities import CTIMEntityBuilder
+from api.pipeline import (
+    DELIBERATE_PIPELINE, OBSERVE_PIPELINE, Enrichment, fetch_details
+)
+from api.utils import (
+    dump_json_line, get_json, get_json_items, get_jwt, jsonify_data,
+    jsonify_result
+)
+from api.validation import ObservableValidator
 
-from flask import Blueprint, g, current_app
+enrich_api = Blueprint('enrich', __name__)
 
-from api.schemas import ObservableSchema
-from api.client import Auth0SignalsClient
-from api.utils import get_json, get_jwt, jsonify_data, jsonify_result
+NDJSON_MIMETYPE = 'application/x-ndjson'
+ENTITY_TYPES = (
+    'verdicts', 'judgements', 'sightings', 'indicators', 'relationships'
+)
 
-enrich_api = Blueprint('enrich', __name__)
 
+@lru_cache(maxsize=None)
+def get_observable_schema(fast):
+    if fast:
+        return ObservableValidator()
 
-get_observables = partial(get_json, schema=ObservableSchema(many=True))
+    # marshmallow is slow to import, so the schema is only built once the
+    # first observables are validated with it.
+    from api.schemas import ObservableSchema
+    return ObservableSchema(many=True)
 
 
-def time_to_ctr_format(time):
-    return time.isoformat() + 'Z'
+def get_observables():
+    schema = get_observable_schema(
+        current_app.config['FAST_VALIDATION_ENABLED']
+    )
 
+    if not current_app.config['INCREMENTAL_PARSING_ENABLED']:
+        return get_json(schema)
 
-def get_valid_time():
-    start_time = datetime.utcnow()
-    end_time = start_time + current_app.config['ENTITY_RELEVANCE_PERIOD']
-    return {
-        'start_time': time_to_ctr_format(start_time),
-        'end_time': time_to_ctr_format(end_time),
-    }
+    return get_json_items(
+        schema,
+        max_count=current_app.config['PAYLOAD_MAX_OBSERVABLES'],
+        max_size=current_app.config['PAYLOAD_MAX_SIZE']
+    )
 
 
-def extract_verdict(output, observable):
-    score = int(output['fullip']['score'])
-    doc = {
-        'observable': observable,
-        'disposition':
-            current_app.config['SCORE_MAPPING'][score]['disposition'],
-        'disposition_name':
-            current_app.config['SCORE_MAPPING'][score]['disposition_name'],
-        'valid_time': get_valid_time(),
-        'type': 'verdict'
-    }
+def create_client(token, deadline=None):
+    # The HTTP stack is only loaded once an endpoint talks to Auth0 Signals.
+    from api.client import create_client
+    return create_client(token, deadline)
+
+
+@enrich_api.record_once
+def init_entity_builder(state):
+    state.app.extensions['ctim_entity_builder'] = \
+        CTIMEntityBuilder(state.app.config)
+
+
+def start_enrichment(client, budgets):
+    return Enrichment(
+        client,
+        current_app.extensions['ctim_entity_builder'].start_request(),
+        limit=current_app.config['CTR_ENTITIES_LIMIT'],
+        buffer_size=current_app.config['PIPELINE_BUFFER_SIZE'],
+        budgets=budgets
+    )
+
+
+def run_pipeline(pipeline, enrichment, observables):
+    """
+    Run the pipeline, gathering the entities of the records, then report
+    the first error met, if any, along with them.
+    """
+
+    for record in pipeline.run(enrichment, observables):
+        for entity_type in ENTITY_TYPES:
+            if entity_type in g:
+                getattr(g, entity_type).extend(getattr(record, entity_type))
+
+    current_app.logger.debug('Enrichment stages took %s', enrichment.timings)
 
-    return doc
+    if enrichment.errors:
+        raise enrichment.errors[0]
 
 
 @enrich_api.route('/deliberate/observables', methods=['POST'])
 def deliberate_observables():
-    client = Auth0SignalsClient(get_jwt())
+    enrichment = start_enrichment(
+        create_client(get_jwt()), budgets=('verdicts',)
+    )
     observables = get_observables()
     g.verdicts = []
 
-    for observable in observables:
-        if observable['type'] == 'ip':
-            response_data = client.get_auth0_response(observable)
-            if response_data:
-                g.verdicts.append(extract_verdict(response_data, observable))
+    run_pipeline(DELIBERATE_PIPELINE, enrichment, observables)
 
     return jsonify_result()
 
 
-def extract_judgements(output, observable):
-    docs = [
-        {
-            'observable': observable,
-            'reason': current_app.config['REASON_MAPPING'][score_element],
-            'source_uri': current_app.config['UI_URL'].format(
-                value=observable['value']
-            ),
-            'id': f'transient:judgement-{uuid4()}',
-            'valid_time': get_valid_time(),
-            **current_app.config['CTIM_JUDGEMENT_DEFAULTS']
-        }
-        for score_element in current_app.config['REASON_MAPPING']
-        if int(output['fullip'][score_element]['score']) < 0
-    ]
-
-    return docs
-
-
-def get_tlp(blocklist):
-    if blocklist['visibility'] == 'Public':
-        return 'white'
-    return 'amber'
-
-
-def extract_sightings(observable, details):
-    start_time = time_to_ctr_format(datetime.utcnow())
-    docs = [
-        {
-            'source': blocklist['source'],
-            'source_uri': blocklist['site'],
-            'observed_time': {
-                'start_time': start_time,
-                'end_time': start_time,
-            },
-            'observables': [observable],
-            'id': f'transient:sighting-{uuid4()}',
-            'tlp': get_tlp(blocklist),
-            'severity': current_app.config['SEVERITY_MAPPING']
-            [blocklist['sensitivity']],
-            **current_app.config['CTIM_SIGHTING_DEFAULTS']
-        }
-        for blocklist in details
-    ]
-    return docs
-
-
-def get_transient_id(entity_type, base_value=None):
-    uuid = (uuid5(current_app.config['NAMESPACE_BASE'], base_value)
-            if base_value else uuid4())
-    return f'transient:{entity_type}-{uuid}'
-
-
-def extract_indicators(details):
-    docs = [
-        {
-            'producer': blocklist['source'],
-            'title': blocklist['name'],
-            'valid_time': {},
-            'id': get_transient_id('indicator', blocklist['name']),
-            'short_description': f'Feed: {blocklist["name"]}',
-            'description': blocklist['description'],
-            'tags': blocklist['tags'].split(','),
-            **current_app.config['CTIM_INDICATOR_DEFAULTS']
-        }
-        for blocklist in details
-    ]
-    return docs
-
-
-def extract_relationships(sightings, indicators):
-    docs = [
-        {
-            'id': f'transient:relationships-{uuid4()}',
-            'source_ref': sighting['id'],
-            'target_ref': indicator['id'],
-            **current_app.config['CTIM_RELATIONSHIP_DEFAULTS']
-        }
-        for sighting, indicator in zip(sightings, indicators)
-    ]
-    return docs
+def wants_stream():
+    """
+    Whether the caller opted in to the NDJSON output, either with the
+    Accept header or with the `format=ndjson` query parameter.
+    """
+
+    if request.args.get('format', '').lower() == 'ndjson':
+        return True
+
+    return request.accept_mimetypes.best_match(
+        [current_app.config['JSONIFY_MIMETYPE'], NDJSON_MIMETYPE]
+    ) == NDJSON_MIMETYPE
+
+
+def stream_observe(enrichment, observables):
+    """
+    Yield the CTIM entities of each observable as lines of NDJSON as soon
+    as it is enriched, then a summary line with the count of each entity
+    type and the errors, if any.
+
+    The same entities limits as in the regular output apply, and nothing
+    but the details of the blocklists already seen is held in memory.
+    """
+
+    # The details are fetched for each observable on its own, so that its
+    # entities are not held back until a whole buffer is looked up.
+    pipeline = OBSERVE_PIPELINE.replace(
+        'fetch_details', partial(fetch_details, chunk_size=1)
+    )
+    counts = dict.fromkeys(ENTITY_TYPES, 0)
+
+    for record in pipeline.run(enrichment, observables):
+        for entity_type in ENTITY_TYPES:
+            docs = getattr(record, entity_type)
+            counts[entity_type] += len(docs)
+            yield from map(dump_json_line, docs)
+
+    current_app.logger.debug('Enrichment stages took %s', enrichment.timings)
+
+    # The response is already under way, so the errors are reported in the
+    # summary along with the entities streamed so far.
+    summary = {'type': 'summary', 'counts': counts}
+    if enrichment.errors:
+        summary['errors'] = [error.json for error in enrichment.errors]
+        for error in enrichment.errors:
+            current_app.logger.error(error.json)
+    yield dump_json_line(summary)
 
 
 @enrich_api.route('/observe/observables', methods=['POST'])
 def observe_observables():
-    client = Auth0SignalsClient(get_jwt())
+    client = create_client(
+        get_jwt(),
+        deadline=monotonic() + current_app.config['OBSERVE_DEADLINE']
+    )
+    # Every blocklist yields exactly one sighting, indicator and
+    # relationship, so they share the same budget.
+    enrichment = start_enrichment(
+        client, budgets=('verdicts', 'judgements', 'blocklists')
+    )
     observables = get_observables()
+
+    if wants_stream():
+        return Response(
+            stream_with_context(stream_observe(enrichment, observables)),
+            mimetype=NDJSON_MIMETYPE
+        )
+
     g.verdicts = []
     g.judgements = []
     g.sightings = []
     g.indicators = []
     g.relationships = []
 
-    for observable in observables:
-        if observable['type'] == 'ip':
-            response_data = client.get_auth0_response(observable)
-            if response_data:
-                g.verdicts.append(extract_verdict(response_data, observable))
-                g.judgements.extend(
-                    extract_judgements(response_data, observable)
-                )
-                details = client.get_full_details(response_data)
-                sightings = extract_sightings(observable, details)
-                g.sightings.extend(sightings)
-                indicators = extract_indicators(details)
-                g.indicators.extend(indicators)
-                g.relationships.extend(
-                    extract_relationships(sightings, indicators)
-                )
+    run_pipeline(OBSERVE_PIPELINE, enrichment, observables)
 
     return jsonify_result()
 
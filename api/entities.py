@@ -0,0 +1,183 @@
+from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+from uuid import uuid4, uuid5
+
+
+def time_to_ctr_format(time):
+    return time.isoformat() + 'Z'
+
+
+def get_tlp(blocklist):
+    if blocklist['visibility'] == 'Public':
+        return 'white'
+    return 'amber'
+
+
+@lru_cache(maxsize=1024)
+def get_indicator_id(namespace, name):
+    return f'transient:indicator-{uuid5(namespace, name)}'
+
+
+class CTIMEntity:
+    """
+    Compact record of a CTIM entity holding only its own fields, along with
+    the template of the fields it shares with the others of its type, which
+    are only merged in when the entity is written out.
+    """
+
+    __slots__ = ('template',)
+
+    def __init__(self, template, *values):
+        self.template = template
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def to_json(self):
+        doc = dict(self.template)
+        for name in self.__slots__:
+            doc[name] = getattr(self, name)
+        return doc
+
+
+class Verdict(CTIMEntity):
+    __slots__ = ('observable', 'valid_time')
+
+
+class Judgement(CTIMEntity):
+    __slots__ = ('observable', 'reason', 'source_uri', 'id', 'valid_time')
+
+
+class Sighting(CTIMEntity):
+    __slots__ = ('source', 'source_uri', 'observed_time', 'observable', 'id',
+                 'tlp', 'severity')
+
+    def to_json(self):
+        doc = super().to_json()
+        doc['observables'] = [doc.pop('observable')]
+        return doc
+
+
+class Indicator(CTIMEntity):
+    __slots__ = ('producer', 'title', 'id', 'description', 'tags')
+
+    def to_json(self):
+        doc = super().to_json()
+        doc['short_description'] = f'Feed: {self.title}'
+        doc['tags'] = self.tags.split(',')
+        return doc
+
+
+class Relationship(CTIMEntity):
+    __slots__ = ('id', 'source_ref', 'target_ref')
+
+
+class CTIMEntityBuilder:
+    """
+    Precomputes the parts shared by the CTIM entities out of the application
+    config once at start, so that building an entity only fills in its own
+    fields on top of a frozen template.
+    """
+
+    def __init__(self, config):
+        self.verdict_templates = {
+            score: MappingProxyType({
+                'type': 'verdict',
+                'disposition': mapping['disposition'],
+                'disposition_name': mapping['disposition_name'],
+            })
+            for score, mapping in config['SCORE_MAPPING'].items()
+        }
+        self.judgement_template = MappingProxyType(
+            dict(config['CTIM_JUDGEMENT_DEFAULTS'])
+        )
+        self.sighting_template = MappingProxyType(
+            dict(config['CTIM_SIGHTING_DEFAULTS'])
+        )
+        self.indicator_template = MappingProxyType(
+            {**config['CTIM_INDICATOR_DEFAULTS'], 'valid_time': {}}
+        )
+        self.relationship_template = MappingProxyType(
+            dict(config['CTIM_RELATIONSHIP_DEFAULTS'])
+        )
+        self.reasons = tuple(config['REASON_MAPPING'].items())
+        self.severities = MappingProxyType(dict(config['SEVERITY_MAPPING']))
+        self.ui_url = config['UI_URL']
+        self.relevance_period = config['ENTITY_RELEVANCE_PERIOD']
+        self.namespace = config['NAMESPACE_BASE']
+
+    def start_request(self):
+        return CTIMEntities(self, datetime.utcnow())
+
+
+class CTIMEntities:
+    """
+    Builds the CTIM entities of a single request, all of them sharing the
+    timestamps computed once at its start.
+    """
+
+    def __init__(self, builder, now):
+        self.builder = builder
+        start_time = time_to_ctr_format(now)
+        self.valid_time = {
+            'start_time': start_time,
+            'end_time': time_to_ctr_format(now + builder.relevance_period),
+        }
+        self.observed_time = {
+            'start_time': start_time,
+            'end_time': start_time,
+        }
+
+    def extract_verdict(self, output, observable):
+        return Verdict(
+            self.builder.verdict_templates[output['score']],
+            observable, self.valid_time
+        )
+
+    def extract_judgements(self, output, observable, value):
+        # The link is built from the value as looked up, which may be
+        # written differently than in the observable.
+        builder = self.builder
+        source_uri = builder.ui_url.format(value=value)
+        return [
+            Judgement(
+                builder.judgement_template, observable, reason, source_uri,
+                f'transient:judgement-{uuid4()}', self.valid_time
+            )
+            for score_element, reason in builder.reasons
+            if output['scores'][score_element] < 0
+        ]
+
+    def extract_sightings(self, observable, details):
+        builder = self.builder
+        return [
+            Sighting(
+                builder.sighting_template, blocklist['source'],
+                blocklist['site'], self.observed_time, observable,
+                f'transient:sighting-{uuid4()}', get_tlp(blocklist),
+                builder.severities[blocklist['sensitivity']]
+            )
+            for blocklist in details
+        ]
+
+    def extract_indicators(self, details):
+        builder = self.builder
+        return [
+            Indicator(
+                builder.indicator_template, blocklist['source'],
+                blocklist['name'],
+                get_indicator_id(builder.namespace, blocklist['name']),
+                blocklist['description'], blocklist['tags']
+            )
+            for blocklist in details
+        ]
+
+    def extract_relationships(self, sightings, indicators):
+        template = self.builder.relationship_template
+        return [
+            Relationship(
+                template, f'transient:relationships-{uuid4()}',
+                sighting.id, indicator.id
+            )
+            for sighting, indicator in zip(sightings, indicators)
+        ]
@@ -3,6 +3,9 @@ PERMISSION_DENIED = 'permission denied'
 UNKNOWN = 'unknown'
 UNAUTHORIZED = 'unauthorized'
 AUTH_ERROR = 'authorization error'
+TOO_MANY_REQUESTS = 'too many requests'
+DEADLINE_EXCEEDED = 'deadline exceeded'
+SERVICE_UNAVAILABLE = 'service unavailable'
 
 
 class TRFormattedError(Exception):
@@ -42,6 +45,42 @@ class UnsupportedObservableTypeError(InvalidArgumentError):
         )
 
 
+class TooManyRequestsError(TRFormattedError):
+    def __init__(self):
+        super().__init__(
+            TOO_MANY_REQUESTS,
+            'Auth0 Signals rate limit is exceeded for the provided API key. '
+            'Try again later.'
+        )
+
+
+class Auth0ConnectionError(TRFormattedError):
+    def __init__(self):
+        super().__init__(
+            UNKNOWN,
+            'Unable to connect to Auth0 Signals. Try again later.'
+        )
+
+
+class DeadlineExceededError(TRFormattedError):
+    def __init__(self):
+        super().__init__(
+            DEADLINE_EXCEEDED,
+            'Auth0 Signals took too long to respond, '
+            'the results may be incomplete.',
+            type_='warning'
+        )
+
+
+class CircuitOpenError(TRFormattedError):
+    def __init__(self, endpoint):
+        super().__init__(
+            SERVICE_UNAVAILABLE,
+            f'Auth0 Signals {endpoint} endpoint is temporarily unavailable. '
+            'Try again later.'
+        )
+
+
 class CriticalError(TRFormattedError):
     def __init__(self, response):
         super().__init__(
@@ -52,7 +91,12 @@ class CriticalError(TRFormattedError):
 
 class Auth0SSLError(TRFormattedError):
     def __init__(self, error):
-        error = error.args[0].reason.args[0]
+        # The error is raised either by requests or by aiohttp.
+        error = (
+            getattr(error, 'certificate_error', None)
+            or getattr(error, 'os_error', None)
+            or error.args[0].reason.args[0]
+        )
         message = getattr(error, 'verify_message', error.args[0]).capitalize()
         super().__init__(
             UNKNOWN,
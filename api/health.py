@@ -1,15 +1,33 @@
 from flask import Blueprint
 
 
+from api.cache import get_cache_stats
 from api.utils import get_jwt, jsonify_data
-from api.client import Auth0SignalsClient
+from api.resilience import get_circuit_breaker_states, get_hedging_stats
 
 health_api = Blueprint('health', __name__)
 
 
 @health_api.route('/health', methods=['POST'])
 def health():
-    client = Auth0SignalsClient(get_jwt())
+    # The HTTP stack is only loaded once an endpoint talks to Auth0 Signals.
+    from api.client import create_client
+
+    client = create_client(get_jwt())
     client.check_health()
 
-    return jsonify_data({'status': 'ok'})
+    data = {
+        'status': 'ok',
+        'circuit_breakers': get_circuit_breaker_states()
+    }
+
+    # Only the caches of the upstream lookups.
+    cache_stats = get_cache_stats('metadata', 'reputation')
+    if cache_stats:
+        data['caches'] = cache_stats
+
+    hedging_stats = get_hedging_stats()
+    if hedging_stats:
+        data['hedging'] = hedging_stats
+
+    return jsonify_data(data)
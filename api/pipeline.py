@@ -0,0 +1,302 @@
+from functools import partial
+from ipaddress import ip_address
+from itertools import islice
+from time import perf_counter
+
+from api.errors import TRFormattedError
+
+
+class Record:
+    """
+    The enrichment of one observable, filled in along the pipeline.
+    """
+
+    def __init__(self, observable, value):
+        self.observable = observable
+        self.value = value
+        self.response_data = None
+        self.verdicts = []
+        self.judgements = []
+        self.blocklists = []
+        self.details = []
+        self.sightings = []
+        self.indicators = []
+        self.relationships = []
+
+
+class Enrichment:
+    """
+    State shared by the stages of one request: the client and the CTIM
+    entities builder, what remains of the entities budgets, the projected
+    responses of the IPs and the details of the blocklists fetched so far
+    and the errors met on the way.
+    """
+
+    def __init__(self, client, entities, limit, buffer_size, budgets):
+        self.client = client
+        self.entities = entities
+        self.buffer_size = buffer_size
+        self.budgets = dict.fromkeys(budgets, limit)
+        self.responses = {}
+        self.details = {}
+        self.errors = []
+        self.timings = {}
+
+    def take(self, budget, docs):
+        docs = docs[:self.budgets[budget]]
+        self.budgets[budget] -= len(docs)
+        return docs
+
+    @property
+    def is_exhausted(self):
+        return bool(self.budgets) and not any(self.budgets.values())
+
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def canonicalize_ip(value):
+    """
+    Return the canonical form of the IP, tolerating surrounding whitespace
+    and leading zeros in the IPv4 octets, or None if it is not an IP.
+    """
+
+    value = value.strip()
+    octets = value.split('.')
+    try:
+        if len(octets) == 4 and all(octet.isascii() and octet.isdigit()
+                                    for octet in octets):
+            value = '.'.join(str(int(octet)) for octet in octets)
+        address = ip_address(value)
+    except ValueError:
+        return None
+
+    return str(getattr(address, 'ipv4_mapped', None) or address)
+
+
+def normalize(enrichment, observables):
+    """
+    Pass on the records of the IP observables, each one looked up by the
+    canonical form of its IP, so that the equivalent ones share a lookup,
+    while the entities still refer to the observable as it was submitted.
+
+    The values that are not IPs are dropped without any lookup, just like
+    upstream would reject them as bad requests.
+    """
+
+    for observable in observables:
+        if observable['type'] == 'ip':
+            value = canonicalize_ip(observable['value'])
+            if value is not None:
+                yield Record(observable, value)
+
+
+def lookup(enrichment, records):
+    """
+    Look up the records a buffer at a time, each distinct canonical IP of
+    the request only once, passing on the records of the IPs found
+    upstream. The responses are kept for the whole request, so that the
+    duplicates of an IP in later buffers are not looked up again.
+
+    A failure stops the lookups, but the records already passed on are
+    still enriched and reported along with the error.
+    """
+
+    try:
+        for chunk in chunked(records, enrichment.buffer_size):
+            responses = enrichment.responses
+            distinct_values = list(dict.fromkeys(
+                record.value for record in chunk
+                if record.value not in responses
+            ))
+            lookups = zip(
+                distinct_values,
+                enrichment.client.get_auth0_responses([
+                    {'type': 'ip', 'value': value}
+                    for value in distinct_values
+                ])
+            )
+
+            for record in chunk:
+                while record.value not in responses:
+                    value, response_data = next(lookups)
+                    responses[value] = response_data
+
+                record.response_data = responses[record.value]
+                if record.response_data:
+                    yield record
+    except TRFormattedError as error:
+        enrichment.errors.append(error)
+
+
+def extract_verdicts(enrichment, records):
+    for record in records:
+        record.verdicts = enrichment.take('verdicts', [
+            enrichment.entities.extract_verdict(
+                record.response_data, record.observable
+            )
+        ])
+        yield record
+        if enrichment.is_exhausted:
+            return
+
+
+def extract_judgements(enrichment, records):
+    for record in records:
+        record.judgements = enrichment.take(
+            'judgements', enrichment.entities.extract_judgements(
+                record.response_data, record.observable, record.value
+            )
+        )
+        yield record
+        if enrichment.is_exhausted:
+            return
+
+
+def fetch_details(enrichment, records, chunk_size=None):
+    """
+    Plan the blocklists of the records within the budget shared by the
+    sightings, indicators and relationships, since every blocklist yields
+    exactly one of each, and fetch the details of each distinct blocklist
+    of a chunk of records at once.
+
+    A failure, such as the deadline being exceeded, stops the fetching,
+    but the verdicts and judgements of the records are still reported.
+    """
+
+    client = enrichment.client
+    chunk_size = chunk_size or enrichment.buffer_size
+    records = iter(records)
+    failed = False
+
+    while not enrichment.is_exhausted:
+        chunk = []
+        for record in records:
+            record.blocklists = enrichment.take(
+                'blocklists', client.get_blocklists(record.response_data)
+            )
+            chunk.append(record)
+            if len(chunk) == chunk_size or enrichment.is_exhausted:
+                break
+
+        if not chunk:
+            return
+
+        if not failed:
+            try:
+                enrichment.details.update(client.get_details_of_the_lists(
+                    blocklist
+                    for record in chunk for blocklist in record.blocklists
+                    if blocklist not in enrichment.details
+                ))
+            except TRFormattedError as error:
+                enrichment.errors.append(error)
+                failed = True
+
+        for record in chunk:
+            if failed:
+                record.blocklists = []
+            record.details = [enrichment.details[blocklist]
+                              for blocklist in record.blocklists]
+            yield record
+
+
+def extract_sightings(enrichment, records):
+    for record in records:
+        record.sightings = enrichment.entities.extract_sightings(
+            record.observable, record.details
+        )
+        yield record
+
+
+def extract_indicators(enrichment, records):
+    for record in records:
+        record.indicators = \
+            enrichment.entities.extract_indicators(record.details)
+        yield record
+
+
+def extract_relationships(enrichment, records):
+    for record in records:
+        record.relationships = enrichment.entities.extract_relationships(
+            record.sightings, record.indicators
+        )
+        yield record
+
+
+def get_stage_name(stage):
+    return (stage.func if isinstance(stage, partial) else stage).__name__
+
+
+def timed(records, timings, name):
+    """
+    Pass the records on, adding the time spent pulling each of them to the
+    timing of the stage, which includes the time spent upstream.
+    """
+
+    records = iter(records)
+
+    while True:
+        started_at = perf_counter()
+        try:
+            record = next(records)
+        except StopIteration:
+            return
+        finally:
+            timings[name] += perf_counter() - started_at
+        yield record
+
+
+class Pipeline:
+    """
+    Chain of stages, each one lazily consuming the records yielded by the
+    previous one, so no more records than a buffer are held at once and
+    the stages not needed by an endpoint are simply left out.
+
+    Every stage is a function of the enrichment and of the records, and
+    the time spent in each of them is kept in the enrichment timings.
+    """
+
+    def __init__(self, *stages):
+        self.stages = stages
+
+    def replace(self, name, stage):
+        return Pipeline(*(
+            stage if get_stage_name(current) == name else current
+            for current in self.stages
+        ))
+
+    def run(self, enrichment, observables):
+        cumulative_timings = dict.fromkeys(
+            map(get_stage_name, self.stages), 0
+        )
+        records = observables
+        for stage in self.stages:
+            records = timed(
+                stage(enrichment, records),
+                cumulative_timings, get_stage_name(stage)
+            )
+
+        try:
+            yield from records
+        finally:
+            # Each stage pulls from the previous one, so its own time is
+            # what remains once the time spent upstream is taken out.
+            upstream = 0
+            for name, cumulative in cumulative_timings.items():
+                enrichment.timings[name] = cumulative - upstream
+                upstream = cumulative
+
+
+DELIBERATE_PIPELINE = Pipeline(normalize, lookup, extract_verdicts)
+
+OBSERVE_PIPELINE = Pipeline(
+    normalize, lookup, extract_verdicts, extract_judgements, fetch_details,
+    extract_sightings, extract_indicators, extract_relationships
+)
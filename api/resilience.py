@@ -0,0 +1,417 @@
+import threading
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, as_completed, wait
+)
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket pacing the requests made with one API key.
+
+    Callers reserve a token before each request and wait for the returned
+    delay, so bursts are spread out instead of being rejected upstream.
+    The balance may go negative to queue the callers up.
+
+    Without a rate, the bucket is unbounded and only paused as told by
+    the upstream rate limit headers.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if rate is not None else float('inf')
+        self.updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        # Nothing is refilled while the bucket is paused.
+        if now > self.updated_at:
+            if self.rate is not None:
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated_at) * self.rate
+                )
+            self.updated_at = now
+
+    def reserve(self, max_wait):
+        """
+        Take a token and return how long to wait before using it, or None
+        (leaving the bucket untouched) if that would exceed the max wait.
+        """
+
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+
+            delay = max(self.updated_at - now, 0)
+            if self.rate is not None:
+                delay += max(1 - self.tokens, 0) / self.rate
+            if delay > max_wait:
+                return None
+
+            self.tokens -= 1
+            return delay
+
+    def pause(self, seconds):
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0)
+            self.updated_at = max(self.updated_at, now + seconds)
+
+    def update(self, headers):
+        """
+        Align the bucket with the rate limit state reported upstream.
+        """
+
+        remaining = parse_number(headers.get('X-RateLimit-Remaining'))
+        if remaining is None:
+            return
+
+        with self._lock:
+            self._refill(monotonic())
+            self.tokens = min(self.tokens, remaining)
+
+        if remaining <= 0:
+            reset = parse_number(headers.get('X-RateLimit-Reset'))
+            if reset is not None:
+                # The reset is either a timestamp or a number of seconds.
+                self.pause(reset - time() if reset > time() / 2 else reset)
+
+
+def parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_after(headers, default):
+    """
+    Return the number of seconds to wait according to the Retry-After
+    header, given either as a number of seconds or as an HTTP date.
+    """
+
+    value = headers.get('Retry-After')
+
+    seconds = parse_number(value)
+    if seconds is not None:
+        return max(seconds, 0)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return default
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker guarding one upstream endpoint family.
+
+    It opens once the share of failed or slow calls among the recent ones
+    reaches the error rate, and rejects the calls while open. After the
+    reset timeout it lets a single probe call through (half-open), whose
+    outcome either closes the breaker again or keeps it open.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, error_rate, latency, window, min_calls,
+                 reset_timeout):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.is_probing = False
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if (self.state == self.OPEN
+                    and monotonic() - self.opened_at >= self.reset_timeout):
+                self.state = self.HALF_OPEN
+                self.is_probing = False
+
+            if self.state == self.HALF_OPEN and not self.is_probing:
+                self.is_probing = True
+                return True
+
+            return False
+
+    def record(self, failed, duration):
+        failed = failed or duration >= self.latency
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                return
+
+            self._outcomes.append(failed)
+            if (len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) >= (self.error_rate
+                                                * len(self._outcomes))):
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = monotonic()
+        self.is_probing = False
+        self._outcomes.clear()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, **settings):
+    """
+    Return the process-wide circuit breaker registered under the name,
+    creating it with the settings on the first call.
+    """
+
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(**settings)
+        return _breakers[name]
+
+
+def get_circuit_breaker_states():
+    with _breakers_lock:
+        return {name: breaker.state for name, breaker in _breakers.items()}
+
+
+def clear_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+class Hedger:
+    """
+    Thread-safe tracker of the latency of the recent calls to one upstream
+    endpoint family, hedging the calls running slower than usual.
+
+    A call still running after the given percentile of the recent latency
+    is raced against a second identical call, and whichever succeeds first
+    wins. Hedges are capped to a share of all the calls made, and are only
+    sent if the caller has the budget for one more request.
+
+    The calls are raced on a pool of the hedger sized for the calls of the
+    threads of one request, along with their hedges. Under the load of
+    concurrent requests, a call may still wait for a worker: its latency
+    only counts from the time it actually starts, and its caller stops
+    waiting for a worker at its deadline.
+    """
+
+    WINDOW = 100
+
+    def __init__(self, percentile, max_rate, min_samples, max_workers):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.requests = 0
+        self.hedges = 0
+        self._latencies = deque(maxlen=self.WINDOW)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """
+        Count a new call and return how long to wait before hedging it,
+        or None while too few latencies are known.
+        """
+
+        with self._lock:
+            self.requests += 1
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+
+        index = round(self.percentile / 100 * (len(latencies) - 1))
+        return latencies[index]
+
+    def _acquire_hedge(self, reserve):
+        with self._lock:
+            if self.hedges + 1 > self.max_rate * self.requests:
+                return False
+            if reserve is not None and not reserve():
+                return False
+            self.hedges += 1
+            return True
+
+    def _record(self, started_at):
+        with self._lock:
+            self._latencies.append(monotonic() - started_at)
+
+    def _submit(self, func):
+        """
+        Run the function on the pool and return its future along with the
+        event set once it starts running.
+        """
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='hedging'
+                )
+
+        started = threading.Event()
+
+        def run():
+            started.set()
+            return func()
+
+        return self._executor.submit(run), started
+
+    def run(self, func, reserve=None, deadline=None):
+        """
+        Call the function, hedging it if it runs too slow. The reserve
+        function, if any, tells whether a hedge may be sent right away.
+
+        `concurrent.futures.TimeoutError` is raised if the call has not
+        started yet by the monotonic deadline, if any.
+        """
+
+        delay = self._start()
+
+        if delay is None:
+            started_at = monotonic()
+            result = func()
+            self._record(started_at)
+            return result
+
+        primary, started = self._submit(func)
+        timeout = None if deadline is None else max(deadline - monotonic(), 0)
+        if not started.wait(timeout) and primary.cancel():
+            raise TimeoutError()
+        started.wait()
+        started_at = monotonic()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._acquire_hedge(reserve):
+            result = primary.result()
+            self._record(started_at)
+            return result
+
+        futures = [primary, self._submit(func)[0]]
+        for future in as_completed(futures):
+            if future.exception() is None:
+                self._record(started_at)
+                return future.result()
+
+        return primary.result()
+
+    async def run_async(self, coroutine_function, reserve=None):
+        import asyncio
+
+        started_at = monotonic()
+        delay = self._start()
+
+        if delay is None:
+            result = await coroutine_function()
+            self._record(started_at)
+            return result
+
+        pending = {asyncio.ensure_future(coroutine_function())}
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done and self._acquire_hedge(reserve):
+            pending.add(asyncio.ensure_future(coroutine_function()))
+
+        tasks = list(pending)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self._record(started_at)
+                        return task.result()
+            return tasks[0].result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    @property
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'hedges': self.hedges,
+            'rate': self.hedges / self.requests if self.requests else 0
+        }
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(name, **settings):
+    """
+    Return the process-wide hedger registered under the name, creating it
+    with the settings on the first call.
+    """
+
+    with _hedgers_lock:
+        if name not in _hedgers:
+            _hedgers[name] = Hedger(**settings)
+        return _hedgers[name]
+
+
+def get_hedging_stats():
+    with _hedgers_lock:
+        return {name: hedger.stats for name, hedger in _hedgers.items()}
+
+
+def clear_hedgers():
+    with _hedgers_lock:
+        for hedger in _hedgers.values():
+            hedger.shutdown()
+        _hedgers.clear()
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_token_bucket(key, rate, capacity):
+    """
+    Return the process-wide token bucket of the key, creating it on the
+    first call.
+    """
+
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(rate, capacity)
+        return _buckets[key]
+
+
+def clear_token_buckets():
+    with _buckets_lock:
+        _buckets.clear()
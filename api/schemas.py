@@ -2,6 +2,8 @@ from functools import partial
 
 from marshmallow import ValidationError, Schema, fields
 
+from api.validation import OBSERVABLE_TYPE_CHOICES
+
 
 def validate_string(value, *, choices=None):
     if value == '':
@@ -14,45 +16,6 @@ def validate_string(value, *, choices=None):
             )
 
 
-OBSERVABLE_TYPE_CHOICES = (
-    'amp_computer_guid',
-    'certificate_common_name',
-    'certificate_issuer',
-    'certificate_serial',
-    'cisco_mid',
-    'device',
-    'domain',
-    'email',
-    'email_messageid',
-    'email_subject',
-    'file_name',
-    'file_path',
-    'hostname',
-    'imei',
-    'imsi',
-    'ip',
-    'ipv6',
-    'mac_address',
-    'md5',
-    'mutex',
-    'ngfw_id',
-    'ngfw_name',
-    'odns_identity',
-    'odns_identity_label',
-    'orbital_node_id',
-    'pki_serial',
-    'process_name',
-    'registry_key',
-    'registry_name',
-    'registry_path',
-    'sha1',
-    'sha256',
-    'url',
-    'user',
-    'user_agent',
-)
-
-
 class ObservableSchema(Schema):
     type = fields.String(
         validate=partial(validate_string, choices=OBSERVABLE_TYPE_CHOICES),
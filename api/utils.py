@@ -1,12 +1,26 @@
-from authlib.jose import jwt
-from authlib.jose.errors import BadSignatureError, DecodeError
-from flask import request, current_app, jsonify, g
-from requests.exceptions import SSLError
+import codecs
+import json
+from concurrent.futures import ThreadPoolExecutor
 
+from flask import request, current_app, g
+from flask import json as flask_json, jsonify as flask_jsonify
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from api.cache import get_cache
+from api.entities import CTIMEntity
 from api.errors import InvalidArgumentError, Auth0SSLError, AuthorizationError
 
 
 def get_jwt():
+    # authlib is slow to import, so it is only loaded once a token is
+    # actually verified.
+    from authlib.jose import jwt
+    from authlib.jose.errors import BadSignatureError, DecodeError
+
     expected_errors = {
         KeyError: 'Wrong JWT payload structure',
         TypeError: '<SECRET_KEY> is missing',
@@ -16,14 +30,29 @@ def get_jwt():
 
     token = get_auth_token()
 
+    # The tokens are reused heavily, so their verified keys are cached
+    # to skip the signature verification on every request.
+    cache = get_cache(
+        'jwt',
+        current_app.config['JWT_CACHE_SIZE'],
+        current_app.config['JWT_CACHE_TTL']
+    )
+    cache_key = (current_app.config['SECRET_KEY'], token)
+
+    key = cache.get(cache_key)
+    if key is not None:
+        return key
+
     try:
         payload = jwt.decode(token, current_app.config['SECRET_KEY'])
-        print(payload['key'])
-        return payload['key']
+        key = payload['key']
     except tuple(expected_errors) as error:
         message = expected_errors[error.__class__]
         raise AuthorizationError(message)
 
+    cache.set(cache_key, key)
+    return key
+
 
 def get_auth_token():
     """
@@ -54,10 +83,225 @@ def get_json(schema):
     return data
 
 
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = ' \t\n\r'
+
+
+class JSONArrayReader:
+    """
+    Incremental reader of the JSON array sent in a stream of bytes, which
+    decodes its items one at a time while holding little more than the
+    item being decoded and the current chunk of the stream.
+
+    The encoding is detected from the first bytes the same way as by
+    `json.loads`, so UTF-16 and UTF-32 are accepted, and so is a BOM.
+
+    It raises ValueError on malformed JSON or on anything but an array,
+    and InvalidArgumentError once more than the max size has been read.
+    """
+
+    def __init__(self, stream, max_size):
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+        self.buffer = ''
+        self.position = 0
+        self.is_exhausted = False
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = None
+        self._head = b''
+
+    def _read(self):
+        if self.is_exhausted:
+            return False
+
+        chunk = self.stream.read(JSON_CHUNK_SIZE)
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise InvalidArgumentError(
+                f'The payload exceeds the limit of {self.max_size} bytes.'
+            )
+
+        self.is_exhausted = not chunk
+
+        if self._text_decoder is None:
+            # The encoding is told by the first four bytes.
+            self._head += chunk
+            if len(self._head) < 4 and chunk:
+                return True
+            self._text_decoder = codecs.getincrementaldecoder(
+                json.detect_encoding(self._head)
+            )()
+            chunk, self._head = self._head, b''
+
+        # Drop what has already been decoded before reading on.
+        self.buffer = self.buffer[self.position:] + \
+            self._text_decoder.decode(chunk, final=self.is_exhausted)
+        self.position = 0
+        return True
+
+    def _next_char(self):
+        """
+        Skip the whitespace and return the next character, or '' at the
+        end of the stream.
+        """
+
+        while True:
+            while (self.position < len(self.buffer)
+                   and self.buffer[self.position] in JSON_WHITESPACE):
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._read():
+                return ''
+
+    def _expect(self, chars):
+        char = self._next_char()
+        if not char or char not in chars:
+            raise ValueError(f'Expected one of {chars!r} in the JSON array.')
+        self.position += 1
+        return char
+
+    def _decode_item(self):
+        self._next_char()
+        while True:
+            try:
+                item, end = self._decoder.raw_decode(
+                    self.buffer, self.position
+                )
+                # A value ending with the buffer, such as a number, may
+                # still go on in the next chunk.
+                if end < len(self.buffer) or self.is_exhausted:
+                    self.position = end
+                    return item
+            except ValueError:
+                if self.is_exhausted:
+                    raise
+            self._read()
+
+    def __iter__(self):
+        self._expect('[')
+        if self._next_char() == ']':
+            self.position += 1
+        else:
+            while True:
+                yield self._decode_item()
+                if self._expect(',]') == ']':
+                    break
+
+        if self._next_char():
+            raise ValueError('Extra data after the JSON array.')
+
+
+def get_json_items(schema, max_count, max_size):
+    """
+    Parse the JSON array sent in the request body incrementally, validating
+    each item as soon as it is decoded, and stop early once more than the
+    max count of items or the max size in bytes is reached.
+
+    The errors are reported the same way as by `get_json`.
+    """
+
+    if (request.content_length or 0) > max_size:
+        raise InvalidArgumentError(
+            f'The payload exceeds the limit of {max_size} bytes.'
+        )
+
+    items = []
+    errors = {}
+
+    try:
+        for index, item in enumerate(
+                JSONArrayReader(request.stream, max_size)
+        ):
+            if index == max_count:
+                raise InvalidArgumentError(
+                    f'The payload exceeds the limit of {max_count} items.'
+                )
+
+            item_errors = schema.validate([item])
+            if item_errors:
+                errors[index] = item_errors[0]
+            items.append(item)
+    except ValueError:
+        # Anything but a well-formed array fails just as it would as a whole.
+        raise InvalidArgumentError(schema.validate(None))
+
+    if errors:
+        raise InvalidArgumentError(errors)
+
+    return items
+
+
 def format_docs(docs):
     return {'count': len(docs), 'docs': docs}
 
 
+def load_json(data):
+    """
+    Parse a JSON document given as bytes or text, with orjson when installed.
+    """
+
+    if orjson is None:
+        return json.loads(data)
+    return orjson.loads(data)
+
+
+def to_json(obj):
+    if isinstance(obj, CTIMEntity):
+        return obj.to_json()
+    raise TypeError(
+        f'Object of type {obj.__class__.__name__} is not JSON serializable'
+    )
+
+
+class JSONEncoder(flask_json.JSONEncoder):
+    """
+    Flask's JSON encoder also writing out the compact CTIM entities.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, CTIMEntity):
+            return obj.to_json()
+        return super().default(obj)
+
+
+def uses_orjson():
+    return (current_app.config['JSON_SERIALIZER'] == 'orjson'
+            and orjson is not None)
+
+
+def dump_json_line(data):
+    """
+    Serialize the data into a compact line of JSON ending with a newline,
+    with the configured serializer.
+    """
+
+    if not uses_orjson():
+        return flask_json.dumps(data, separators=(',', ':')) + '\n'
+
+    # Mirror Flask's output: sorted keys and a trailing newline.
+    option = orjson.OPT_APPEND_NEWLINE
+    if current_app.config['JSON_SORT_KEYS']:
+        option |= orjson.OPT_SORT_KEYS
+
+    return orjson.dumps(data, default=to_json, option=option)
+
+
+def jsonify(data):
+    """
+    Serialize the data into a JSON response with the configured serializer,
+    falling back to Flask's own encoder when orjson is not installed.
+    """
+
+    if not uses_orjson():
+        return flask_jsonify(data)
+
+    return current_app.response_class(
+        dump_json_line(data), mimetype=current_app.config['JSONIFY_MIMETYPE']
+    )
+
+
 def jsonify_data(data):
     return jsonify({'data': data})
 
@@ -90,9 +334,31 @@ def join_url(base, *parts):
 
 
 def ssl_error_handler(func):
+    from requests.exceptions import SSLError
+
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         except SSLError as error:
             raise Auth0SSLError(error)
     return wrapper
+
+
+def map_concurrently(func, items, max_workers):
+    """
+    Apply the function to each item using a bounded pool of threads.
+
+    Results are yielded in the order of the items, so the output stays
+    deterministic. An exception raised for an item is re-raised when its
+    turn comes, and the calls for the remaining items are cancelled.
+    """
+
+    items = list(items)
+
+    if max_workers < 2 or len(items) < 2:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_workers,
+                                            len(items))) as executor:
+        yield from executor.map(func, items)
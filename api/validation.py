@@ -0,0 +1,116 @@
+# The same messages as the marshmallow schemas, so the errors reported by
+# both validation paths are identical.
+INVALID_INPUT_TYPE = 'Invalid input type.'
+MISSING_FIELD = 'Missing data for required field.'
+NULL_FIELD = 'Field may not be null.'
+INVALID_STRING = 'Not a valid string.'
+BLANK_FIELD = 'Field may not be blank.'
+UNKNOWN_FIELD = 'Unknown field.'
+
+OBSERVABLE_TYPE_CHOICES = (
+    'amp_computer_guid',
+    'certificate_common_name',
+    'certificate_issuer',
+    'certificate_serial',
+    'cisco_mid',
+    'device',
+    'domain',
+    'email',
+    'email_messageid',
+    'email_subject',
+    'file_name',
+    'file_path',
+    'hostname',
+    'imei',
+    'imsi',
+    'ip',
+    'ipv6',
+    'mac_address',
+    'md5',
+    'mutex',
+    'ngfw_id',
+    'ngfw_name',
+    'odns_identity',
+    'odns_identity_label',
+    'orbital_node_id',
+    'pki_serial',
+    'process_name',
+    'registry_key',
+    'registry_name',
+    'registry_path',
+    'sha1',
+    'sha256',
+    'url',
+    'user',
+    'user_agent',
+)
+
+OBSERVABLE_TYPES = frozenset(OBSERVABLE_TYPE_CHOICES)
+
+INVALID_CHOICE = \
+    f'Must be one of: {", ".join(map(repr, OBSERVABLE_TYPE_CHOICES))}.'
+
+# marshmallow visits the fields of a schema in the iteration order of a set
+# of their names, and finds the unknown fields with a set difference, so the
+# same sets are used here to report the errors in the same order.
+OBSERVABLE_FIELDS = set(('type', 'value'))
+
+
+def validate_observable_field(name, value):
+    if value is None:
+        return NULL_FIELD
+    if not isinstance(value, str):
+        return INVALID_STRING
+    if value == '':
+        return BLANK_FIELD
+    if name == 'type' and value not in OBSERVABLE_TYPES:
+        return INVALID_CHOICE
+    return None
+
+
+class ObservableValidator:
+    """
+    Single pass validator of a list of observables parsed from JSON, which
+    reports the errors exactly as `ObservableSchema(many=True).validate`
+    does, but without its per item and per field overhead.
+    """
+
+    def validate(self, data):
+        if not isinstance(data, list):
+            return {'_schema': [INVALID_INPUT_TYPE]}
+
+        errors = {}
+        for index, item in enumerate(data):
+            # The valid observables, by far the most common, are told apart
+            # with a few lookups.
+            if type(item) is dict and len(item) == 2:
+                type_, value = item.get('type'), item.get('value')
+                if (type(type_) is str and type_ in OBSERVABLE_TYPES
+                        and type(value) is str and value):
+                    continue
+
+            item_errors = self.validate_observable(item)
+            if item_errors:
+                errors[index] = item_errors
+
+        return errors
+
+    @staticmethod
+    def validate_observable(item):
+        if not isinstance(item, dict):
+            return {'_schema': [INVALID_INPUT_TYPE]}
+
+        errors = {}
+        for name in OBSERVABLE_FIELDS:
+            if name not in item:
+                errors[name] = [MISSING_FIELD]
+                continue
+
+            message = validate_observable_field(name, item[name])
+            if message is not None:
+                errors[name] = [message]
+
+        for name in set(item) - OBSERVABLE_FIELDS:
+            errors[name] = [UNKNOWN_FIELD]
+
+        return errors
@@ -5,12 +5,13 @@ from api.health import health_api
 from api.respond import respond_api
 
 from api.errors import TRFormattedError
-from api.utils import jsonify_result
+from api.utils import JSONEncoder, jsonify_result
 
 app = Flask(__name__)
 
 app.url_map.strict_slashes = False
 app.config.from_object('config.Config')
+app.json_encoder = JSONEncoder
 
 app.register_blueprint(health_api)
 app.register_blueprint(enrich_api)
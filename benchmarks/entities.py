@@ -0,0 +1,63 @@
+"""
+Measures how fast the CTIM entities of an observe call are built for
+1,000 IPs, each with two judgements and two blocklists.
+
+Run it from the project root with: python -m benchmarks.entities
+"""
+
+from timeit import repeat
+
+from app import app
+
+IPS = 1000
+REPEAT = 5
+
+RESPONSE_DATA = {
+    'score': -2,
+    'scores': {'baddomain': 0, 'badip': -1, 'history': -1},
+    'blocklists': (('badip', 'FAIL2BAN-SSH'),),
+}
+
+DETAILS = [
+    {
+        'name': name,
+        'source': 'Fail2Ban and Blocklist.de services',
+        'site': 'http://www.blocklist.de',
+        'sensitivity': '1',
+        'visibility': 'Public',
+        'tags': 'reputation,abuse,bruteforce',
+        'description': 'www.blocklist.de is a free and voluntary service.',
+    }
+    for name in ('FAIL2BAN-SSH', 'STOPFORUMSPAM-365')
+]
+
+
+def build_entities(builder, observables):
+    entities = builder.start_request()
+    for observable in observables:
+        entities.extract_verdict(RESPONSE_DATA, observable)
+        entities.extract_judgements(
+            RESPONSE_DATA, observable, observable['value']
+        )
+        sightings = entities.extract_sightings(observable, DETAILS)
+        indicators = entities.extract_indicators(DETAILS)
+        entities.extract_relationships(sightings, indicators)
+
+
+def main():
+    builder = app.extensions['ctim_entity_builder']
+    observables = [
+        {'type': 'ip', 'value': f'10.0.{i // 256}.{i % 256}'}
+        for i in range(IPS)
+    ]
+
+    best = min(repeat(
+        lambda: build_entities(builder, observables),
+        number=1, repeat=REPEAT
+    ))
+    print(f'{IPS} IPs: {best * 1000:.1f} ms, '
+          f'{IPS / best:,.0f} IPs/s (best of {REPEAT})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Profiles the import of the application module by module, the same way as
+`python -X importtime -c "import app"`, heaviest first.
+
+Run it from the project root with: python -m benchmarks.imports
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOP = 20
+
+
+def profile_import(module='app'):
+    """
+    Import the module in a fresh interpreter and return its import time
+    along with the (module, self time, cumulative time) of every module it
+    loaded, all in microseconds.
+    """
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((name.strip(), int(self_time), int(cumulative)))
+
+    total = next(cumulative for name, _, cumulative in reversed(timings)
+                 if name == module)
+    return total, timings
+
+
+def main():
+    total, timings = profile_import()
+    print(f'import app: {total / 1000:.1f} ms')
+    for name, self_time, cumulative in sorted(
+            timings, key=lambda timing: timing[2], reverse=True
+    )[:TOP]:
+        print(f'{cumulative / 1000:8.1f} ms {self_time / 1000:8.1f} ms  '
+              f'{name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares the peak memory, measured with tracemalloc, taken by the CTIM
+entities of an observe request for 500 IPs while they are held until the
+response is written: as compact entity records, or as the plain dicts
+they are written out as.
+
+Run it from the project root with: python -m benchmarks.memory
+"""
+
+import tracemalloc
+
+from app import app
+from benchmarks.entities import DETAILS, RESPONSE_DATA
+
+IPS = 500
+
+
+def as_dicts(entities):
+    return [entity.to_json() for entity in entities]
+
+
+def hold_entities(builder, observables, convert):
+    entities = builder.start_request()
+    held = []
+    for observable in observables:
+        held.extend(convert([
+            entities.extract_verdict(RESPONSE_DATA, observable)
+        ]))
+        held.extend(convert(
+            entities.extract_judgements(
+                RESPONSE_DATA, observable, observable['value']
+            )
+        ))
+        sightings = entities.extract_sightings(observable, DETAILS)
+        indicators = entities.extract_indicators(DETAILS)
+        relationships = entities.extract_relationships(sightings, indicators)
+        held.extend(convert([*sightings, *indicators, *relationships]))
+    return held
+
+
+def measure_peak(builder, observables, convert):
+    tracemalloc.start()
+    try:
+        held = hold_entities(builder, observables, convert)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return len(held), peak
+
+
+def main():
+    builder = app.extensions['ctim_entity_builder']
+    observables = [
+        {'type': 'ip', 'value': f'10.0.{i // 256}.{i % 256}'}
+        for i in range(IPS)
+    ]
+
+    peaks = {}
+    for name, convert in (('dicts', as_dicts), ('records', list)):
+        count, peaks[name] = measure_peak(builder, observables, convert)
+        print(f'{name}: {count:,} entities, '
+              f'peak {peaks[name] / 1024:,.0f} KiB')
+
+    print(f'drop: {1 - peaks["records"] / peaks["dicts"]:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Compares how fast the stdlib and orjson serializers encode an observe
+response, made by scaling the conftest payload up to 1,000 IPs.
+
+Run it from the project root with: python -m benchmarks.serialization
+"""
+
+from timeit import repeat
+
+from app import app
+from api.utils import jsonify, orjson
+from tests.unit.conftest import success_observe_body
+
+IPS = 1000
+REPEAT = 5
+
+
+def scale_up(payload, times):
+    data = {}
+    for entity_type, entities in payload['data'].items():
+        docs = entities['docs'] * times
+        data[entity_type] = {'count': len(docs), 'docs': docs}
+    return {'data': data}
+
+
+def main():
+    payload = scale_up(success_observe_body.__wrapped__(), IPS)
+    serializers = ['stdlib'] + (['orjson'] if orjson is not None else [])
+
+    with app.test_request_context():
+        for serializer in serializers:
+            app.config['JSON_SERIALIZER'] = serializer
+            size = len(jsonify(payload).data)
+            best = min(repeat(lambda: jsonify(payload),
+                              number=1, repeat=REPEAT))
+            print(f'{serializer}: {best * 1000:.1f} ms for {size:,} bytes '
+                  f'(best of {REPEAT})')
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,23 @@ class Config:
 
     SECRET_KEY = os.environ.get('SECRET_KEY', None)
 
+    JWT_DEFAULT_CACHE_SIZE = 1024
+
+    try:
+        JWT_CACHE_SIZE = int(os.environ['JWT_CACHE_SIZE'])
+        assert JWT_CACHE_SIZE > 0
+    except (KeyError, ValueError, AssertionError):
+        JWT_CACHE_SIZE = JWT_DEFAULT_CACHE_SIZE
+
+    # Time to live (in seconds) of the cached keys of the verified JWTs.
+    JWT_DEFAULT_CACHE_TTL = 60 * 60
+
+    try:
+        JWT_CACHE_TTL = int(os.environ['JWT_CACHE_TTL'])
+        assert JWT_CACHE_TTL > 0
+    except (KeyError, ValueError, AssertionError):
+        JWT_CACHE_TTL = JWT_DEFAULT_CACHE_TTL
+
     API_URL = 'https://signals.api.auth0.com/'
     UI_URL = 'https://auth0.com/signals/ip/{value}-report'
 
@@ -83,6 +100,325 @@ class Config:
     except (KeyError, ValueError, AssertionError):
         CTR_ENTITIES_LIMIT = CTR_DEFAULT_ENTITIES_LIMIT
 
+    CTR_DEFAULT_CONCURRENCY_LIMIT = 10
+
+    try:
+        CTR_CONCURRENCY_LIMIT = int(os.environ['CTR_CONCURRENCY_LIMIT'])
+        assert CTR_CONCURRENCY_LIMIT > 0
+    except (KeyError, ValueError, AssertionError):
+        CTR_CONCURRENCY_LIMIT = CTR_DEFAULT_CONCURRENCY_LIMIT
+
+    # The number of observables looked up, and of which the blocklists are
+    # fetched, at once by the enrichment pipeline.
+    PIPELINE_DEFAULT_BUFFER_SIZE = 100
+
+    try:
+        PIPELINE_BUFFER_SIZE = int(os.environ['PIPELINE_BUFFER_SIZE'])
+        assert PIPELINE_BUFFER_SIZE > 0
+    except (KeyError, ValueError, AssertionError):
+        PIPELINE_BUFFER_SIZE = PIPELINE_DEFAULT_BUFFER_SIZE
+
+    # Validate the observables in a single pass with the same error messages
+    # as the marshmallow schema, which is used otherwise.
+    FAST_VALIDATION_ENABLED = os.environ.get(
+        'FAST_VALIDATION_ENABLED', 'true'
+    ).lower() not in ('0', 'false', 'no')
+
+    # Parse the observables out of the request body incrementally, failing
+    # as soon as the payload goes over either limit.
+    INCREMENTAL_PARSING_ENABLED = os.environ.get(
+        'INCREMENTAL_PARSING_ENABLED', 'true'
+    ).lower() not in ('0', 'false', 'no')
+
+    PAYLOAD_DEFAULT_MAX_OBSERVABLES = 10000
+
+    try:
+        PAYLOAD_MAX_OBSERVABLES = int(os.environ['PAYLOAD_MAX_OBSERVABLES'])
+        assert PAYLOAD_MAX_OBSERVABLES > 0
+    except (KeyError, ValueError, AssertionError):
+        PAYLOAD_MAX_OBSERVABLES = PAYLOAD_DEFAULT_MAX_OBSERVABLES
+
+    PAYLOAD_DEFAULT_MAX_SIZE = 5 * 1024 * 1024
+
+    try:
+        PAYLOAD_MAX_SIZE = int(os.environ['PAYLOAD_MAX_SIZE'])
+        assert PAYLOAD_MAX_SIZE > 0
+    except (KeyError, ValueError, AssertionError):
+        PAYLOAD_MAX_SIZE = PAYLOAD_DEFAULT_MAX_SIZE
+
+    # Either 'sync' to make the upstream requests from a pool of threads,
+    # or 'async' to make them all at once on a process-wide event loop.
+    CLIENT_ENGINE = os.environ.get('CLIENT_ENGINE', 'sync').lower()
+
+    # Either 'stdlib' to encode the responses with Flask's own encoder,
+    # or 'orjson' to use the much faster orjson library. It is one of the
+    # requirements, Flask's encoder is only used instead where it is not
+    # installed.
+    JSON_SERIALIZER = os.environ.get('JSON_SERIALIZER', 'stdlib').lower()
+
+    ASYNC_DEFAULT_CONCURRENCY_LIMIT = 100
+
+    try:
+        ASYNC_CONCURRENCY_LIMIT = int(os.environ['ASYNC_CONCURRENCY_LIMIT'])
+        assert ASYNC_CONCURRENCY_LIMIT > 0
+    except (KeyError, ValueError, AssertionError):
+        ASYNC_CONCURRENCY_LIMIT = ASYNC_DEFAULT_CONCURRENCY_LIMIT
+
+    HTTP_DEFAULT_POOL_SIZE = 10
+
+    try:
+        HTTP_POOL_SIZE = int(os.environ['HTTP_POOL_SIZE'])
+        assert HTTP_POOL_SIZE > 0
+    except (KeyError, ValueError, AssertionError):
+        HTTP_POOL_SIZE = HTTP_DEFAULT_POOL_SIZE
+
+    # Idle time (in seconds) before TCP keep-alive probes are sent on
+    # the pooled connections.
+    HTTP_DEFAULT_KEEPALIVE = 60
+
+    try:
+        HTTP_KEEPALIVE = int(os.environ['HTTP_KEEPALIVE'])
+        assert HTTP_KEEPALIVE > 0
+    except (KeyError, ValueError, AssertionError):
+        HTTP_KEEPALIVE = HTTP_DEFAULT_KEEPALIVE
+
+    # Timeouts (in seconds) for establishing a connection to Auth0 Signals
+    # and for waiting on its response.
+    HTTP_DEFAULT_CONNECT_TIMEOUT = 3.05
+
+    try:
+        HTTP_CONNECT_TIMEOUT = float(os.environ['HTTP_CONNECT_TIMEOUT'])
+        assert HTTP_CONNECT_TIMEOUT > 0
+    except (KeyError, ValueError, AssertionError):
+        HTTP_CONNECT_TIMEOUT = HTTP_DEFAULT_CONNECT_TIMEOUT
+
+    HTTP_DEFAULT_READ_TIMEOUT = 10
+
+    try:
+        HTTP_READ_TIMEOUT = float(os.environ['HTTP_READ_TIMEOUT'])
+        assert HTTP_READ_TIMEOUT > 0
+    except (KeyError, ValueError, AssertionError):
+        HTTP_READ_TIMEOUT = HTTP_DEFAULT_READ_TIMEOUT
+
+    # Number of times a request failing with a connection error, a timeout
+    # or a 5xx response is sent again.
+    HTTP_DEFAULT_RETRIES = 2
+
+    try:
+        HTTP_RETRIES = int(os.environ['HTTP_RETRIES'])
+        assert HTTP_RETRIES >= 0
+    except (KeyError, ValueError, AssertionError):
+        HTTP_RETRIES = HTTP_DEFAULT_RETRIES
+
+    # Base delay (in seconds) of the exponential backoff between retries.
+    HTTP_DEFAULT_RETRY_BACKOFF = 0.25
+
+    try:
+        HTTP_RETRY_BACKOFF = float(os.environ['HTTP_RETRY_BACKOFF'])
+        assert HTTP_RETRY_BACKOFF >= 0
+    except (KeyError, ValueError, AssertionError):
+        HTTP_RETRY_BACKOFF = HTTP_DEFAULT_RETRY_BACKOFF
+
+    # Time budget (in seconds) of an observe request, the entities gathered
+    # by then are returned along with a warning.
+    OBSERVE_DEFAULT_DEADLINE = 20
+
+    try:
+        OBSERVE_DEADLINE = float(os.environ['OBSERVE_DEADLINE'])
+        assert OBSERVE_DEADLINE > 0
+    except (KeyError, ValueError, AssertionError):
+        OBSERVE_DEADLINE = OBSERVE_DEFAULT_DEADLINE
+
+    CIRCUIT_BREAKER_ENABLED = os.environ.get(
+        'CIRCUIT_BREAKER_ENABLED', 'true'
+    ).lower() not in ('0', 'false', 'no')
+
+    # Share of failed or slow calls among the recent ones opening the
+    # circuit breaker of an endpoint family.
+    CIRCUIT_BREAKER_DEFAULT_ERROR_RATE = 0.5
+
+    try:
+        CIRCUIT_BREAKER_ERROR_RATE = float(
+            os.environ['CIRCUIT_BREAKER_ERROR_RATE']
+        )
+        assert 0 < CIRCUIT_BREAKER_ERROR_RATE <= 1
+    except (KeyError, ValueError, AssertionError):
+        CIRCUIT_BREAKER_ERROR_RATE = CIRCUIT_BREAKER_DEFAULT_ERROR_RATE
+
+    # Duration (in seconds) after which a call is considered slow.
+    CIRCUIT_BREAKER_DEFAULT_LATENCY = 5
+
+    try:
+        CIRCUIT_BREAKER_LATENCY = float(os.environ['CIRCUIT_BREAKER_LATENCY'])
+        assert CIRCUIT_BREAKER_LATENCY > 0
+    except (KeyError, ValueError, AssertionError):
+        CIRCUIT_BREAKER_LATENCY = CIRCUIT_BREAKER_DEFAULT_LATENCY
+
+    # Number of the recent calls the error rate is computed over.
+    CIRCUIT_BREAKER_DEFAULT_WINDOW = 20
+
+    try:
+        CIRCUIT_BREAKER_WINDOW = int(os.environ['CIRCUIT_BREAKER_WINDOW'])
+        assert CIRCUIT_BREAKER_WINDOW > 0
+    except (KeyError, ValueError, AssertionError):
+        CIRCUIT_BREAKER_WINDOW = CIRCUIT_BREAKER_DEFAULT_WINDOW
+
+    # Least number of the recent calls needed to open the circuit breaker.
+    CIRCUIT_BREAKER_DEFAULT_MIN_CALLS = 10
+
+    try:
+        CIRCUIT_BREAKER_MIN_CALLS = int(
+            os.environ['CIRCUIT_BREAKER_MIN_CALLS']
+        )
+        assert CIRCUIT_BREAKER_MIN_CALLS > 0
+    except (KeyError, ValueError, AssertionError):
+        CIRCUIT_BREAKER_MIN_CALLS = CIRCUIT_BREAKER_DEFAULT_MIN_CALLS
+
+    # Time (in seconds) an open circuit breaker waits before letting
+    # a probe call through.
+    CIRCUIT_BREAKER_DEFAULT_RESET_TIMEOUT = 30
+
+    try:
+        CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+            os.environ['CIRCUIT_BREAKER_RESET_TIMEOUT']
+        )
+        assert CIRCUIT_BREAKER_RESET_TIMEOUT > 0
+    except (KeyError, ValueError, AssertionError):
+        CIRCUIT_BREAKER_RESET_TIMEOUT = CIRCUIT_BREAKER_DEFAULT_RESET_TIMEOUT
+
+    HEDGING_ENABLED = os.environ.get(
+        'HEDGING_ENABLED', 'false'
+    ).lower() in ('1', 'true', 'yes')
+
+    # Percentile of the recent latency of an endpoint family after which
+    # a still running request is hedged with a second identical one.
+    HEDGING_DEFAULT_PERCENTILE = 95
+
+    try:
+        HEDGING_PERCENTILE = float(os.environ['HEDGING_PERCENTILE'])
+        assert 0 < HEDGING_PERCENTILE <= 100
+    except (KeyError, ValueError, AssertionError):
+        HEDGING_PERCENTILE = HEDGING_DEFAULT_PERCENTILE
+
+    # Largest share of the requests allowed to be hedged.
+    HEDGING_DEFAULT_MAX_RATE = 0.05
+
+    try:
+        HEDGING_MAX_RATE = float(os.environ['HEDGING_MAX_RATE'])
+        assert 0 < HEDGING_MAX_RATE <= 1
+    except (KeyError, ValueError, AssertionError):
+        HEDGING_MAX_RATE = HEDGING_DEFAULT_MAX_RATE
+
+    # Least number of the recent latencies needed to start hedging.
+    HEDGING_DEFAULT_MIN_SAMPLES = 20
+
+    try:
+        HEDGING_MIN_SAMPLES = int(os.environ['HEDGING_MIN_SAMPLES'])
+        assert HEDGING_MIN_SAMPLES > 0
+    except (KeyError, ValueError, AssertionError):
+        HEDGING_MIN_SAMPLES = HEDGING_DEFAULT_MIN_SAMPLES
+
+    RATE_LIMIT_ENABLED = os.environ.get(
+        'RATE_LIMIT_ENABLED', 'true'
+    ).lower() not in ('0', 'false', 'no')
+
+    # Number of requests per second allowed for each API key. Unbounded by
+    # default, the requests are then only paced as told by Auth0 Signals
+    # through its X-RateLimit-Remaining, X-RateLimit-Reset and Retry-After
+    # headers.
+    RATE_LIMIT_DEFAULT_RATE = None
+
+    try:
+        RATE_LIMIT_RATE = float(os.environ['RATE_LIMIT_RATE'])
+        assert RATE_LIMIT_RATE > 0
+    except (KeyError, ValueError, AssertionError):
+        RATE_LIMIT_RATE = RATE_LIMIT_DEFAULT_RATE
+
+    # Number of requests allowed at once for each API key, only used along
+    # with RATE_LIMIT_RATE.
+    RATE_LIMIT_DEFAULT_BURST = 20
+
+    try:
+        RATE_LIMIT_BURST = int(os.environ['RATE_LIMIT_BURST'])
+        assert RATE_LIMIT_BURST > 0
+    except (KeyError, ValueError, AssertionError):
+        RATE_LIMIT_BURST = RATE_LIMIT_DEFAULT_BURST
+
+    # Longest time (in seconds) a request may wait for its turn
+    # before failing.
+    RATE_LIMIT_DEFAULT_MAX_WAIT = 10
+
+    try:
+        RATE_LIMIT_MAX_WAIT = float(os.environ['RATE_LIMIT_MAX_WAIT'])
+        assert RATE_LIMIT_MAX_WAIT >= 0
+    except (KeyError, ValueError, AssertionError):
+        RATE_LIMIT_MAX_WAIT = RATE_LIMIT_DEFAULT_MAX_WAIT
+
+    # Number of times a request rejected with 429 Too Many Requests
+    # is sent again after waiting for its Retry-After.
+    RATE_LIMIT_DEFAULT_RETRIES = 2
+
+    try:
+        RATE_LIMIT_RETRIES = int(os.environ['RATE_LIMIT_RETRIES'])
+        assert RATE_LIMIT_RETRIES >= 0
+    except (KeyError, ValueError, AssertionError):
+        RATE_LIMIT_RETRIES = RATE_LIMIT_DEFAULT_RETRIES
+
+    METADATA_CACHE_ENABLED = os.environ.get(
+        'METADATA_CACHE_ENABLED', 'true'
+    ).lower() not in ('0', 'false', 'no')
+
+    METADATA_CACHE_DEFAULT_SIZE = 256
+
+    try:
+        METADATA_CACHE_SIZE = int(os.environ['METADATA_CACHE_SIZE'])
+        assert METADATA_CACHE_SIZE > 0
+    except (KeyError, ValueError, AssertionError):
+        METADATA_CACHE_SIZE = METADATA_CACHE_DEFAULT_SIZE
+
+    # Time to live (in seconds) of the cached blocklist metadata.
+    METADATA_CACHE_DEFAULT_TTL = 6 * 60 * 60
+
+    try:
+        METADATA_CACHE_TTL = int(os.environ['METADATA_CACHE_TTL'])
+        assert METADATA_CACHE_TTL > 0
+    except (KeyError, ValueError, AssertionError):
+        METADATA_CACHE_TTL = METADATA_CACHE_DEFAULT_TTL
+
+    REPUTATION_CACHE_ENABLED = os.environ.get(
+        'REPUTATION_CACHE_ENABLED', 'true'
+    ).lower() not in ('0', 'false', 'no')
+
+    REPUTATION_CACHE_DEFAULT_SIZE = 4096
+
+    try:
+        REPUTATION_CACHE_SIZE = int(os.environ['REPUTATION_CACHE_SIZE'])
+        assert REPUTATION_CACHE_SIZE > 0
+    except (KeyError, ValueError, AssertionError):
+        REPUTATION_CACHE_SIZE = REPUTATION_CACHE_DEFAULT_SIZE
+
+    # Time to live (in seconds) of the cached IP reputation results, kept
+    # well below ENTITY_RELEVANCE_PERIOD.
+    REPUTATION_CACHE_DEFAULT_TTL = 15 * 60
+
+    try:
+        REPUTATION_CACHE_TTL = int(os.environ['REPUTATION_CACHE_TTL'])
+        assert REPUTATION_CACHE_TTL > 0
+    except (KeyError, ValueError, AssertionError):
+        REPUTATION_CACHE_TTL = REPUTATION_CACHE_DEFAULT_TTL
+
+    # Time to live (in seconds) of the empty results returned by
+    # Auth0 Signals for the IPs it does not know about.
+    REPUTATION_CACHE_DEFAULT_NEGATIVE_TTL = 60
+
+    try:
+        REPUTATION_CACHE_NEGATIVE_TTL = int(
+            os.environ['REPUTATION_CACHE_NEGATIVE_TTL']
+        )
+        assert REPUTATION_CACHE_NEGATIVE_TTL > 0
+    except (KeyError, ValueError, AssertionError):
+        REPUTATION_CACHE_NEGATIVE_TTL = REPUTATION_CACHE_DEFAULT_NEGATIVE_TTL
+
     ENTITY_RELEVANCE_PERIOD = timedelta(days=7)
 
     NAMESPACE_BASE = NAMESPACE_X500
@@ -1,10 +1,28 @@
+import json
+import logging
+from copy import deepcopy
+from hashlib import sha256
 from http import HTTPStatus
+from ssl import SSLCertVerificationError
+from threading import Event, Semaphore, Thread
+from time import monotonic, sleep
 
-from pytest import fixture
+from aiohttp import ClientConnectorCertificateError
+from pytest import fixture, raises
+from requests.exceptions import ConnectionError, Timeout
 
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
-from .utils import headers
+from api.cache import clear_caches, get_cache
+from api.client import create_client
+from api.errors import (
+    AUTH_ERROR, DEADLINE_EXCEEDED, INVALID_ARGUMENT, TOO_MANY_REQUESTS,
+    DeadlineExceededError, TRFormattedError
+)
+from api.resilience import get_hedging_stats
+from app import app
+
+from .utils import aiohttp_responses_by_url, headers, responses_by_url
 
 
 def routes():
@@ -45,21 +63,123 @@ def test_enrich_call_with_valid_jwt_but_invalid_json_failure(
     assert response.json == invalid_json_expected_payload
 
 
+@fixture(scope='module')
+def invalid_payloads():
+    return [
+        None,
+        {'type': 'ip', 'value': '1.1.1.1'},
+        [1, None, 'ip'],
+        [{}],
+        [{'type': 'ip', 'value': '1.1.1.1'}, {'type': 'unknown', 'value': 1}],
+        [{'type': '', 'value': None, 'extra': [], 'other': {}}],
+        [{'type': ['ip'], 'value': True}],
+    ]
+
+
+def test_enrich_call_fast_validation_matches_schema_errors(
+        route, client, valid_jwt, invalid_payloads, monkeypatch
+):
+    for payload in invalid_payloads:
+        errors = []
+        for fast in (True, False):
+            monkeypatch.setitem(app.config, 'FAST_VALIDATION_ENABLED', fast)
+            response = client.post(route, headers=headers(valid_jwt),
+                                   json=payload)
+            assert response.status_code == HTTPStatus.OK
+            errors.append(response.json['errors'])
+
+        assert errors[0] == errors[1]
+        assert errors[0][0]['code'] == INVALID_ARGUMENT
+
+
+@fixture(scope='module')
+def raw_payloads():
+    return [
+        b'',
+        b'[',
+        b'null',
+        b'{"type": "ip", "value": "1.1.1.1"}',
+        b'[{"type": "ip", "value": "1.1.1.1"},]',
+        b'[{"type": "ip", "value": "1.1.1.1"}] []',
+        b'[{"type": "ip", "value": "1.1.1.1"} {"type": "ip"}]',
+        b'\xff[]',
+        b' [ ] ',
+        b'[1, 23456, {"type": "ip"}, "\xc3\xa9"]',
+        b'[{"type": "ip", "value": "1.1.1.1"}, {"value": ""}]',
+        b'\xef\xbb\xbf[{"type": "ip", "value": "1.1.1.1"}]',
+        '[{"type": "ip", "value": "1.1.1.1"}]'.encode('utf-16'),
+        '[{"type": "ip", "value": "1.1.1.1"}]'.encode('utf-16-be'),
+        '[{"type": "ip", "value": "1.1.1.1"}, 1]'.encode('utf-32'),
+        '[{"type": "ip"}, "\xe9"]'.encode('utf-32-le'),
+    ]
+
+
+@patch('requests.Session.get')
+def test_refer_call_incremental_parsing_matches_whole_body(
+        get_mock, client, valid_jwt, raw_payloads, monkeypatch
+):
+    # Tiny chunks, so the values are split between the reads.
+    monkeypatch.setattr('api.utils.JSON_CHUNK_SIZE', 3)
+
+    for payload in raw_payloads:
+        responses = []
+        for incremental in (True, False):
+            monkeypatch.setitem(
+                app.config, 'INCREMENTAL_PARSING_ENABLED', incremental
+            )
+            response = client.post(
+                '/refer/observables', headers=headers(valid_jwt),
+                data=payload, content_type='application/json'
+            )
+            assert response.status_code == HTTPStatus.OK
+            responses.append(response.json)
+
+        assert responses[0] == responses[1], payload
+
+    get_mock.assert_not_called()
+
+
+@patch('requests.Session.get')
+def test_enrich_call_rejects_oversized_payloads(
+        get_mock, route, client, valid_jwt, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'PAYLOAD_MAX_OBSERVABLES', 2)
+    monkeypatch.setitem(app.config, 'PAYLOAD_MAX_SIZE', 200)
+    observable = {'type': 'ip', 'value': '1.1.1.1'}
+
+    for payload, message in (
+            ([observable] * 3, 'The payload exceeds the limit of 2 items.'),
+            ([{**observable, 'value': '1' * 200}],
+             'The payload exceeds the limit of 200 bytes.')
+    ):
+        response = client.post(route, headers=headers(valid_jwt),
+                               json=payload)
+
+        assert response.status_code == HTTPStatus.OK
+        assert response.json['errors'] == [
+            {'code': INVALID_ARGUMENT,
+             'message': f'Invalid JSON payload received. {message}',
+             'type': 'fatal'}
+        ]
+
+    get_mock.assert_not_called()
+
+
 @fixture(scope='module')
 def valid_json():
     return [{'type': 'ip', 'value': '1.1.1.1'}]
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_enrich_call_success(
         get_mock, route, client, valid_jwt, valid_json,
         auth0_signals_response_ok, auth0_signals_response_details,
         success_enrich_expected_payload
 ):
-    get_mock.side_effect = [
-        auth0_signals_response_ok,
-        auth0_signals_response_details
-    ]
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/1.1.1.1': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
     response = client.post(route, headers=headers(valid_jwt), json=valid_json)
     assert response.status_code == HTTPStatus.OK
     response = response.get_json()
@@ -96,7 +216,7 @@ def valid_json_multiple():
             {'type': 'ip', 'value': '1.1.1.3'}]
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_enrich_call_success_with_extended_error_handling(
         get_mock, route, client, valid_jwt, valid_json_multiple,
         auth0_signals_response_ok, auth0_signals_response_details,
@@ -105,16 +225,12 @@ def test_enrich_call_success_with_extended_error_handling(
         auth0_signals_bad_request, unauthorized_creds_expected_payload
 ):
     if route != '/refer/observables':
-        mock_responses = [
-            auth0_signals_response_ok,
-            auth0_signals_bad_request,
-            auth0_signals_response_unauthorized_creds
-        ]
-
-        if route == '/observe/observables':
-            mock_responses.insert(1, auth0_signals_response_details)
-
-        get_mock.side_effect = mock_responses
+        get_mock.side_effect = responses_by_url({
+            'v2.0/ip/1.1.1.1': auth0_signals_response_ok,
+            'v2.0/ip/*@^': auth0_signals_bad_request,
+            'v2.0/ip/1.1.1.3': auth0_signals_response_unauthorized_creds,
+            'metadata/': auth0_signals_response_details
+        })
         response = client.post(
             route, headers=headers(valid_jwt), json=valid_json_multiple
         )
@@ -154,7 +270,7 @@ def test_enrich_call_success_with_extended_error_handling(
         assert response == expected_result
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_enrich_with_ssl_error(
         mock_request, route, client, valid_jwt,
         valid_json, auth0_ssl_exception_mock,
@@ -171,3 +287,929 @@ def test_enrich_with_ssl_error(
 
         response = response.get_json()
         assert response == ssl_error_expected_payload
+
+
+@fixture(scope='module')
+def valid_json_concurrent():
+    return [{'type': 'ip', 'value': f'1.1.1.{index}'}
+            for index in range(1, 9)]
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_keeps_order_of_concurrent_lookups(
+        get_mock, client, valid_jwt, valid_json_concurrent,
+        auth0_signals_response_ok
+):
+    def delayed_response(url, *args, **kwargs):
+        # The earlier the observable, the slower its upstream response.
+        sleep((9 - int(url.rsplit('.', 1)[-1])) / 100)
+        return auth0_signals_response_ok
+
+    get_mock.side_effect = delayed_response
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=valid_json_concurrent
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    verdicts = response.get_json()['data']['verdicts']['docs']
+    assert [verdict['observable'] for verdict in verdicts] == \
+        valid_json_concurrent
+
+
+@patch('requests.Session.get')
+def test_observe_call_caches_blocklist_metadata(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_response_details
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
+
+    for value in ('1.1.1.1', '1.1.1.2'):
+        response = client.post(
+            '/observe/observables', headers=headers(valid_jwt),
+            json=[{'type': 'ip', 'value': value}]
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.get_json()['data']['sightings']['count'] == 1
+
+    metadata_calls = [call for call in get_mock.call_args_list
+                      if 'metadata/' in call[0][0]]
+    assert len(metadata_calls) == 1
+    assert get_cache('metadata', 1, 1).stats == {
+        'hits': 1, 'misses': 1, 'size': 1
+    }
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_caches_reputation_results(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_bad_request
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/1.1.1.1': auth0_signals_response_ok,
+        'v2.0/ip/1.1.1.2': auth0_signals_bad_request
+    })
+    observables = [{'type': 'ip', 'value': '1.1.1.1'},
+                   {'type': 'ip', 'value': '1.1.1.2'}]
+
+    responses = [
+        client.post('/deliberate/observables',
+                    headers=headers(valid_jwt), json=observables)
+        for _ in range(2)
+    ]
+
+    assert get_mock.call_count == 2
+    verdicts = [response.get_json()['data']['verdicts'] for response in
+                responses]
+    for verdict in verdicts:
+        assert verdict['count'] == 1
+        verdict['docs'][0].pop('valid_time')
+    assert verdicts[0] == verdicts[1]
+    assert get_cache('reputation', 1, 1).stats == {
+        'hits': 2, 'misses': 2, 'size': 2
+    }
+
+
+@patch('requests.Session.get')
+def test_observe_call_looks_up_canonical_ips(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_response_details
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
+    observables = [{'type': 'ip', 'value': value} for value in (
+        '1.1.1.1', ' 001.1.01.1 ', '::ffff:1.1.1.1', '*@^', '1.1.1.256',
+        '2001:DB8::0:1'
+    )]
+
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt), json=observables
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    lookups = [call[0][0].rsplit('/', 1)[-1]
+               for call in get_mock.call_args_list
+               if 'v2.0/ip/' in call[0][0]]
+    assert lookups == ['1.1.1.1', '2001:db8::1']
+
+    data = response.get_json()['data']
+    expected_observables = observables[:3] + observables[-1:]
+    assert [verdict['observable'] for verdict in
+            data['verdicts']['docs']] == expected_observables
+    assert [sighting['observables'] for sighting in
+            data['sightings']['docs']] == [
+        [observable] for observable in expected_observables
+    ]
+    # The links to the reports are built from the canonical IPs.
+    assert [(judgement['observable'], judgement['source_uri'])
+            for judgement in data['judgements']['docs']] == [
+        (observable, f'https://auth0.com/signals/ip/{value}-report')
+        for observable, value in zip(expected_observables, (
+            '1.1.1.1', '1.1.1.1', '1.1.1.1', '2001:db8::1'
+        ))
+        for _ in range(2)
+    ]
+
+
+@patch('requests.Session.get')
+def test_observe_call_caches_compact_upstream_records(
+        get_mock, client, valid_jwt, valid_json, auth0_signals_response_ok,
+        auth0_signals_response_details
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
+
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt), json=valid_json
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    token_hash = sha256(b'test_api_key').hexdigest()
+    assert get_cache('reputation', 1, 1).get((token_hash, '1.1.1.1')) == {
+        'score': -2,
+        'scores': {'baddomain': 0, 'badip': -1, 'history': -1},
+        'blocklists': (('badip', 'FAIL2BAN-SSH'),)
+    }
+    details = get_cache('metadata', 1, 1).get(('badip', 'FAIL2BAN-SSH'))
+    assert set(details) == {'name', 'source', 'site', 'sensitivity',
+                            'visibility', 'description', 'tags'}
+
+
+def look_up_concurrently(look_up, count):
+    """
+    Make the lookup from as many threads at once, each one with a client
+    of its own, and return what each lookup returned or raised.
+    """
+
+    def run(index):
+        try:
+            results[index] = look_up(clients[index])
+        except TRFormattedError as error:
+            results[index] = error
+
+    with app.app_context():
+        clients = [create_client('key') for _ in range(count)]
+
+    results = [None] * count
+    threads = [Thread(target=run, args=(index,))
+               for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def look_up_ip(client):
+    return client.get_auth0_response({'type': 'ip', 'value': '1.1.1.1'})
+
+
+def look_up_details(client):
+    return client.get_details_of_the_list('badip', 'FAIL2BAN-SSH')
+
+
+@patch('requests.Session.get')
+def test_concurrent_identical_lookups_are_coalesced(
+        get_mock, auth0_signals_response_ok, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'REPUTATION_CACHE_ENABLED', False)
+
+    def slow_response(url, *args, **kwargs):
+        sleep(0.1)
+        return auth0_signals_response_ok
+
+    get_mock.side_effect = slow_response
+
+    results = look_up_concurrently(look_up_ip, 4)
+
+    assert get_mock.call_count == 1
+    assert results[0]['score'] == -2
+    assert all(result == results[0] for result in results)
+
+
+@patch('aiohttp.ClientSession.get')
+def test_concurrent_identical_lookups_are_coalesced_with_async_engine(
+        async_get_mock, auth0_signals_response_ok,
+        auth0_signals_response_details, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CLIENT_ENGINE', 'async')
+    monkeypatch.setitem(app.config, 'REPUTATION_CACHE_ENABLED', False)
+    monkeypatch.setitem(app.config, 'METADATA_CACHE_ENABLED', False)
+    async_get_mock.side_effect = aiohttp_responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    }, delay=0.1)
+
+    for look_up in (look_up_ip, look_up_details):
+        async_get_mock.reset_mock()
+
+        results = look_up_concurrently(look_up, 4)
+
+        assert async_get_mock.call_count == 1
+        assert isinstance(results[0], dict)
+        assert all(result == results[0] for result in results)
+
+
+@patch('requests.Session.get')
+def test_concurrent_identical_lookups_share_their_error(
+        get_mock, auth0_signals_response_unauthorized_creds, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'REPUTATION_CACHE_ENABLED', False)
+
+    def slow_response(url, *args, **kwargs):
+        sleep(0.1)
+        return auth0_signals_response_unauthorized_creds
+
+    get_mock.side_effect = slow_response
+
+    results = look_up_concurrently(look_up_ip, 4)
+
+    assert get_mock.call_count == 1
+    for result in results:
+        assert result.json == {
+            'code': AUTH_ERROR,
+            'message': 'Authorization failed: '
+                       'Unauthorized. API Key not found.',
+            'type': 'fatal'
+        }
+
+
+@patch('requests.Session.get')
+def test_coalesced_lookups_stay_within_the_deadline_of_each_caller(
+        get_mock, auth0_signals_response_details, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'METADATA_CACHE_ENABLED', False)
+    monkeypatch.setitem(app.config, 'HTTP_RETRY_BACKOFF', 0)
+    upstream_called = Event()
+
+    def fetch_concurrently(leader, follower):
+        results = {}
+
+        def fetch(client):
+            started_at = monotonic()
+            try:
+                result = client.get_details_of_the_list(
+                    'badip', 'FAIL2BAN-SSH'
+                )
+            except DeadlineExceededError as error:
+                result = error
+            results[client] = result, monotonic() - started_at
+
+        upstream_called.clear()
+        threads = [Thread(target=fetch, args=(client,))
+                   for client in (leader, follower)]
+        threads[0].start()
+        upstream_called.wait()
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+
+        return results[leader], results[follower]
+
+    with app.app_context():
+        # The deadline of the leader is exceeded, the follower without
+        # any deadline makes the call again instead of failing as well.
+        def stalled_once(url, *args, **kwargs):
+            upstream_called.set()
+            if get_mock.call_count == 1:
+                sleep(0.2)
+                raise Timeout()
+            return auth0_signals_response_details
+
+        get_mock.side_effect = stalled_once
+        leader, follower = fetch_concurrently(
+            create_client('key-a', deadline=monotonic() + 0.1),
+            create_client('key-b')
+        )
+
+        assert isinstance(leader[0], DeadlineExceededError)
+        assert follower[0]['name'] == 'FAIL2BAN-SSH Blocklist.de'
+        assert get_mock.call_count == 2
+
+        # The follower stops waiting on a slower leader at its deadline.
+        def slow(url, *args, **kwargs):
+            upstream_called.set()
+            sleep(0.5)
+            return auth0_signals_response_details
+
+        get_mock.reset_mock()
+        get_mock.side_effect = slow
+        leader, follower = fetch_concurrently(
+            create_client('key-b'),
+            create_client('key-a', deadline=monotonic() + 0.1)
+        )
+
+        assert leader[0]['name'] == 'FAIL2BAN-SSH Blocklist.de'
+        assert isinstance(follower[0], DeadlineExceededError)
+        assert follower[1] < 0.3
+        assert get_mock.call_count == 1
+
+
+@patch('requests.Session.get')
+def test_observe_call_looks_up_duplicate_observables_and_blocklists_once(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_response_details, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'REPUTATION_CACHE_ENABLED', False)
+    monkeypatch.setitem(app.config, 'METADATA_CACHE_ENABLED', False)
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
+    observables = [{'type': 'ip', 'value': '1.1.1.1'},
+                   {'type': 'ip', 'value': '1.1.1.2'},
+                   {'type': 'ip', 'value': '1.1.1.1'}]
+
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt), json=observables
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    data = response.get_json()['data']
+    assert [verdict['observable'] for verdict in data['verdicts']['docs']] \
+        == observables
+    assert [sighting['observables']
+            for sighting in data['sightings']['docs']] == \
+        [[observable] for observable in observables]
+    assert [call[0][0].rsplit('/', 1)[-1]
+            for call in get_mock.call_args_list
+            if 'v2.0/ip/' in call[0][0]].count('1.1.1.1') == 1
+    # The blocklist shared by both IPs is fetched once for the whole batch.
+    assert get_mock.call_count == 3
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_looks_up_duplicates_across_buffers_once(
+        get_mock, client, valid_jwt, auth0_signals_response_ok, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'REPUTATION_CACHE_ENABLED', False)
+    monkeypatch.setitem(app.config, 'PIPELINE_BUFFER_SIZE', 2)
+    get_mock.return_value = auth0_signals_response_ok
+    observables = [{'type': 'ip', 'value': value} for value in (
+        '9.9.9.9', '1.1.1.1', '1.1.1.2', '009.9.9.9', '1.1.1.1'
+    )]
+
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=observables
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert [verdict['observable'] for verdict in
+            response.get_json()['data']['verdicts']['docs']] == observables
+    assert sorted(call[0][0].rsplit('/', 1)[-1]
+                  for call in get_mock.call_args_list) == [
+        '1.1.1.1', '1.1.1.2', '9.9.9.9'
+    ]
+
+
+@patch('requests.Session.get')
+def test_observe_call_fetches_blocklist_details_concurrently(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_response_details, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CTR_ENTITIES_LIMIT', 4)
+    output = deepcopy(auth0_signals_response_ok.json())
+    output['fullip']['badip']['blacklists'] = ['A', 'B', 'C']
+    output['fullip']['baddomain']['domain'].update(
+        blacklist=['D'], blacklist_mx=['E']
+    )
+    auth0_signals_response_ok.json = lambda: output
+
+    def details_response(list_id):
+        details = {**auth0_signals_response_details.json(), 'name': list_id}
+        return MagicMock(ok=True, content=json.dumps(details).encode())
+
+    def upstream_response(url, *args, **kwargs):
+        if 'v2.0/ip/' in url:
+            return auth0_signals_response_ok
+        # The earlier the blocklist, the slower its details.
+        list_id = url.rsplit('/', 1)[-1]
+        sleep((ord('F') - ord(list_id)) / 100)
+        return details_response(list_id)
+
+    get_mock.side_effect = upstream_response
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt),
+        json=[{'type': 'ip', 'value': '1.1.1.1'}]
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    indicators = response.get_json()['data']['indicators']['docs']
+    assert [indicator['title'] for indicator in indicators] == \
+        ['A', 'B', 'C', 'D']
+    assert get_mock.call_count == 5
+
+
+@patch('requests.Session.get')
+def test_observe_call_enforces_entities_limit_across_observables(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_response_details, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CTR_ENTITIES_LIMIT', 2)
+    monkeypatch.setitem(app.config, 'CTR_CONCURRENCY_LIMIT', 1)
+    output = deepcopy(auth0_signals_response_ok.json())
+    output['fullip']['badip']['blacklists'] = ['A', 'B', 'C']
+    auth0_signals_response_ok.json = lambda: output
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
+    observables = [{'type': 'ip', 'value': f'1.1.1.{index}'}
+                   for index in range(1, 4)]
+
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt), json=observables
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    data = response.get_json()['data']
+    for entity_type in ('verdicts', 'judgements', 'sightings',
+                        'indicators', 'relationships'):
+        assert data[entity_type]['count'] == 2
+
+    urls = [call[0][0] for call in get_mock.call_args_list]
+    # The third IP is not looked up since every budget is already used up.
+    assert [url.rsplit('/', 1)[-1] for url in urls if 'v2.0/ip/' in url] \
+        == ['1.1.1.1', '1.1.1.2']
+    assert [url.rsplit('/', 1)[-1] for url in urls if 'metadata/' in url] \
+        == ['A', 'B']
+
+
+def without_volatile_fields(payload):
+    volatile_fields = ('id', 'valid_time', 'observed_time',
+                       'source_ref', 'target_ref')
+    if isinstance(payload, dict):
+        return {key: without_volatile_fields(value)
+                for key, value in payload.items()
+                if key not in volatile_fields}
+    if isinstance(payload, list):
+        return [without_volatile_fields(value) for value in payload]
+    return payload
+
+
+@patch('aiohttp.ClientSession.get')
+@patch('requests.Session.get')
+def test_enrich_call_with_async_engine_matches_sync_engine(
+        get_mock, async_get_mock, route, client, valid_jwt,
+        valid_json_multiple, auth0_signals_response_ok,
+        auth0_signals_response_details, auth0_signals_bad_request,
+        auth0_signals_response_unauthorized_creds, monkeypatch
+):
+    responses = {
+        'v2.0/ip/1.1.1.1': auth0_signals_response_ok,
+        'v2.0/ip/*@^': auth0_signals_bad_request,
+        'v2.0/ip/1.1.1.3': auth0_signals_response_unauthorized_creds,
+        'metadata/': auth0_signals_response_details
+    }
+    get_mock.side_effect = responses_by_url(responses)
+    async_get_mock.side_effect = aiohttp_responses_by_url(responses)
+
+    payloads = {}
+    for engine in ('sync', 'async'):
+        clear_caches()
+        monkeypatch.setitem(app.config, 'CLIENT_ENGINE', engine)
+        response = client.post(
+            route, headers=headers(valid_jwt), json=valid_json_multiple
+        )
+        assert response.status_code == HTTPStatus.OK
+        payloads[engine] = without_volatile_fields(response.get_json())
+
+    assert payloads['async'] == payloads['sync']
+    if route != '/refer/observables':
+        assert get_mock.call_count == async_get_mock.call_count
+        assert payloads['async']['errors'][0]['code'] == AUTH_ERROR
+
+
+@patch('requests.Session.get')
+def test_enrich_call_with_orjson_serializer_matches_stdlib(
+        get_mock, route, client, valid_jwt, valid_json_multiple,
+        auth0_signals_response_ok, auth0_signals_response_details,
+        auth0_signals_bad_request, auth0_signals_response_unauthorized_creds,
+        monkeypatch
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/1.1.1.1': auth0_signals_response_ok,
+        'v2.0/ip/*@^': auth0_signals_bad_request,
+        'v2.0/ip/1.1.1.3': auth0_signals_response_unauthorized_creds,
+        'metadata/': auth0_signals_response_details
+    })
+
+    payloads = []
+    for serializer, installed in (('stdlib', True), ('orjson', True),
+                                  ('orjson', False)):
+        monkeypatch.setitem(app.config, 'JSON_SERIALIZER', serializer)
+        if not installed:
+            monkeypatch.setattr('api.utils.orjson', None)
+        response = client.post(
+            route, headers=headers(valid_jwt), json=valid_json_multiple
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.mimetype == 'application/json'
+        assert response.data.endswith(b'\n')
+        payloads.append(without_volatile_fields(response.get_json()))
+
+    assert payloads[0] == payloads[1] == payloads[2]
+
+
+@patch('aiohttp.ClientSession.get')
+def test_observe_call_with_async_engine_and_ssl_error(
+        async_get_mock, client, valid_jwt, valid_json, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CLIENT_ENGINE', 'async')
+    certificate_error = SSLCertVerificationError(1, 'verify failed')
+    certificate_error.verify_message = 'self signed certificate'
+    async_get_mock.side_effect = ClientConnectorCertificateError(
+        MagicMock(), certificate_error
+    )
+
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt), json=valid_json
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json() == {
+        'data': {},
+        'errors': [
+            {'code': 'unknown',
+             'message': 'Unable to verify SSL certificate: '
+                        'Self signed certificate',
+             'type': 'fatal'}
+        ]
+    }
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_waits_for_retry_after_on_too_many_requests(
+        get_mock, client, valid_jwt, valid_json, auth0_signals_response_ok
+):
+    too_many_requests = MagicMock(
+        ok=False, status_code=HTTPStatus.TOO_MANY_REQUESTS,
+        headers={'Retry-After': '0.2'}
+    )
+    get_mock.side_effect = [too_many_requests, auth0_signals_response_ok]
+
+    started_at = monotonic()
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=valid_json
+    )
+
+    assert monotonic() - started_at >= 0.2
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json()['data']['verdicts']['count'] == 1
+    assert get_mock.call_count == 2
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_is_only_paced_as_told_upstream(
+        get_mock, client, valid_jwt, auth0_signals_response_ok
+):
+    get_mock.return_value = auth0_signals_response_ok
+    observables = [{'type': 'ip', 'value': f'1.1.{index // 256}.{index % 256}'}
+                   for index in range(100)]
+
+    started_at = monotonic()
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=observables
+    )
+
+    assert monotonic() - started_at < 1
+    assert response.get_json()['data']['verdicts']['count'] == 100
+    assert get_mock.call_count == 100
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_fails_fast_when_rate_limit_is_exhausted(
+        get_mock, client, valid_jwt, auth0_signals_response_ok, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CTR_CONCURRENCY_LIMIT', 1)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_MAX_WAIT', 1)
+    auth0_signals_response_ok.headers = {
+        'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '60'
+    }
+    get_mock.return_value = auth0_signals_response_ok
+
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=[{'type': 'ip', 'value': '1.1.1.1'},
+              {'type': 'ip', 'value': '1.1.1.2'}]
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    response = response.get_json()
+    assert response['data']['verdicts']['count'] == 1
+    assert response['errors'] == [
+        {'code': TOO_MANY_REQUESTS,
+         'message': 'Auth0 Signals rate limit is exceeded for the provided '
+                    'API key. Try again later.',
+         'type': 'fatal'}
+    ]
+    assert get_mock.call_count == 1
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_retries_server_errors_with_timeouts(
+        get_mock, client, valid_jwt, valid_json, auth0_signals_response_ok,
+        monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HTTP_RETRY_BACKOFF', 0)
+    server_error = MagicMock(
+        ok=False, status_code=HTTPStatus.BAD_GATEWAY, headers={}
+    )
+    get_mock.side_effect = [
+        server_error, ConnectionError(), auth0_signals_response_ok
+    ]
+
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=valid_json
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json()['data']['verdicts']['count'] == 1
+    assert get_mock.call_count == 3
+    for call in get_mock.call_args_list:
+        assert call[1]['timeout'] == (
+            app.config['HTTP_CONNECT_TIMEOUT'],
+            app.config['HTTP_READ_TIMEOUT']
+        )
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_with_persistent_connection_errors(
+        get_mock, client, valid_jwt, valid_json, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HTTP_RETRY_BACKOFF', 0)
+    get_mock.side_effect = Timeout()
+
+    response = client.post(
+        '/deliberate/observables', headers=headers(valid_jwt),
+        json=valid_json
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.get_json() == {
+        'data': {},
+        'errors': [
+            {'code': 'unknown',
+             'message': 'Unable to connect to Auth0 Signals. '
+                        'Try again later.',
+             'type': 'fatal'}
+        ]
+    }
+    assert get_mock.call_count == app.config['HTTP_RETRIES'] + 1
+
+
+@patch('requests.Session.get')
+def test_observe_call_returns_partial_results_when_deadline_is_exceeded(
+        get_mock, client, valid_jwt, auth0_signals_response_ok,
+        auth0_signals_response_details, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CTR_CONCURRENCY_LIMIT', 1)
+    monkeypatch.setitem(app.config, 'OBSERVE_DEADLINE', 0.3)
+
+    def upstream_response(url, *args, timeout, **kwargs):
+        if url.endswith('1.1.1.2'):
+            # Stall until the read timeout cut down to the deadline.
+            sleep(timeout[1])
+            raise Timeout()
+        return responses_by_url({
+            'v2.0/ip/': auth0_signals_response_ok,
+            'metadata/': auth0_signals_response_details
+        })(url)
+
+    get_mock.side_effect = upstream_response
+    observables = [{'type': 'ip', 'value': f'1.1.1.{index}'}
+                   for index in range(1, 4)]
+
+    started_at = monotonic()
+    response = client.post(
+        '/observe/observables', headers=headers(valid_jwt), json=observables
+    )
+
+    assert monotonic() - started_at < 1
+    assert response.status_code == HTTPStatus.OK
+    response = response.get_json()
+    assert response['errors'] == [
+        {'code': DEADLINE_EXCEEDED,
+         'message': 'Auth0 Signals took too long to respond, '
+                    'the results may be incomplete.',
+         'type': 'warning'}
+    ]
+    assert response['data']['verdicts']['count'] == 1
+    assert response['data']['judgements']['count'] == 2
+    assert 'sightings' not in response['data']
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_hedges_slow_lookups(
+        get_mock, client, valid_jwt, auth0_signals_response_ok, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HEDGING_ENABLED', True)
+    monkeypatch.setitem(app.config, 'HEDGING_MIN_SAMPLES', 1)
+    monkeypatch.setitem(app.config, 'HEDGING_MAX_RATE', 0.5)
+    calls = []
+
+    def upstream_response(url, *args, **kwargs):
+        calls.append(url)
+        # The first lookup of the second IP stalls, its hedge does not.
+        if calls.count(url) == 1 and url.endswith('1.1.1.2'):
+            sleep(1)
+        return auth0_signals_response_ok
+
+    get_mock.side_effect = upstream_response
+
+    for value in ('1.1.1.1', '1.1.1.2'):
+        started_at = monotonic()
+        response = client.post(
+            '/deliberate/observables', headers=headers(valid_jwt),
+            json=[{'type': 'ip', 'value': value}]
+        )
+        assert response.get_json()['data']['verdicts']['count'] == 1
+
+    assert monotonic() - started_at < 1
+    assert get_mock.call_count == 3
+    assert get_hedging_stats()['v2.0/ip'] == {
+        'requests': 2, 'hedges': 1, 'rate': 0.5
+    }
+
+
+@patch('requests.Session.get')
+def test_deliberate_call_hedges_only_within_the_rate_limit(
+        get_mock, client, valid_jwt, auth0_signals_response_ok, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HEDGING_ENABLED', True)
+    monkeypatch.setitem(app.config, 'HEDGING_MIN_SAMPLES', 1)
+    monkeypatch.setitem(app.config, 'HEDGING_MAX_RATE', 0.5)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_RATE', 2)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_BURST', 1)
+
+    def upstream_response(url, *args, **kwargs):
+        if url.endswith('1.1.1.2'):
+            sleep(0.3)
+        return auth0_signals_response_ok
+
+    get_mock.side_effect = upstream_response
+
+    for value in ('1.1.1.1', '1.1.1.2'):
+        response = client.post(
+            '/deliberate/observables', headers=headers(valid_jwt),
+            json=[{'type': 'ip', 'value': value}]
+        )
+        assert response.get_json()['data']['verdicts']['count'] == 1
+
+    # The token the hedge would need is only available 0.5s later.
+    assert get_mock.call_count == 2
+    assert get_hedging_stats()['v2.0/ip'] == {
+        'requests': 2, 'hedges': 0, 'rate': 0
+    }
+
+
+@patch('requests.Session.get')
+def test_hedged_lookups_wait_for_a_worker_only_until_the_deadline(
+        get_mock, auth0_signals_response_ok, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HEDGING_ENABLED', True)
+    monkeypatch.setitem(app.config, 'HEDGING_MIN_SAMPLES', 1)
+    monkeypatch.setitem(app.config, 'CTR_CONCURRENCY_LIMIT', 1)
+    slow_calls = Semaphore(0)
+
+    def upstream_response(url, *args, **kwargs):
+        if not url.endswith('1.1.1.1'):
+            slow_calls.release()
+            sleep(0.5)
+        return auth0_signals_response_ok
+
+    get_mock.side_effect = upstream_response
+
+    with app.app_context():
+        create_client('key').get_auth0_response(
+            {'type': 'ip', 'value': '1.1.1.1'}
+        )
+
+        # Both of the workers of the hedging pool are kept busy.
+        threads = [
+            Thread(target=create_client('key').get_auth0_response,
+                   args=({'type': 'ip', 'value': value},))
+            for value in ('1.1.1.2', '1.1.1.3')
+        ]
+        for thread in threads:
+            thread.start()
+        for _ in threads:
+            slow_calls.acquire()
+
+        started_at = monotonic()
+        with raises(DeadlineExceededError):
+            create_client(
+                'key', deadline=monotonic() + 0.1
+            ).get_auth0_response({'type': 'ip', 'value': '1.1.1.4'})
+        assert monotonic() - started_at < 0.3
+
+        for thread in threads:
+            thread.join()
+
+    assert not any(call[0][0].endswith('1.1.1.4')
+                   for call in get_mock.call_args_list)
+
+
+@fixture(scope='module', params=('header', 'query'))
+def stream_request(request, valid_jwt):
+    if request.param == 'header':
+        return '/observe/observables', {
+            **headers(valid_jwt), 'Accept': 'application/x-ndjson'
+        }
+    return '/observe/observables?format=ndjson', headers(valid_jwt)
+
+
+@patch('requests.Session.get')
+def test_observe_call_streams_ndjson_entities(
+        get_mock, client, valid_jwt, stream_request, valid_json_multiple,
+        auth0_signals_response_ok, auth0_signals_response_details,
+        auth0_signals_bad_request, auth0_signals_response_unauthorized_creds
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/1.1.1.1': auth0_signals_response_ok,
+        'v2.0/ip/*@^': auth0_signals_bad_request,
+        'v2.0/ip/1.1.1.3': auth0_signals_response_unauthorized_creds,
+        'metadata/': auth0_signals_response_details
+    })
+    expected = client.post(
+        '/observe/observables', headers=headers(valid_jwt),
+        json=valid_json_multiple
+    ).get_json()
+
+    # A fresh client, since the context preserved by the shared one would
+    # be pushed again by the stream and leak into the next requests.
+    url, request_headers = stream_request
+    response = app.test_client().post(url, headers=request_headers,
+                                      json=valid_json_multiple)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.mimetype == 'application/x-ndjson'
+
+    *docs, summary = map(json.loads, response.data.splitlines())
+    data = {}
+    for doc in docs:
+        data.setdefault(f'{doc["type"]}s', []).append(doc)
+
+    assert without_volatile_fields(data) == without_volatile_fields({
+        entity_type: entities['docs']
+        for entity_type, entities in expected['data'].items()
+    })
+    assert summary == {
+        'type': 'summary',
+        'counts': {
+            'verdicts': 1, 'judgements': 2, 'sightings': 1,
+            'indicators': 1, 'relationships': 1
+        },
+        'errors': expected['errors']
+    }
+
+
+@patch('requests.Session.get')
+def test_enrich_call_runs_and_times_only_its_pipeline_stages(
+        get_mock, client, valid_jwt, valid_json, auth0_signals_response_ok,
+        auth0_signals_response_details, caplog
+):
+    get_mock.side_effect = responses_by_url({
+        'v2.0/ip/': auth0_signals_response_ok,
+        'metadata/': auth0_signals_response_details
+    })
+    caplog.set_level(logging.DEBUG, logger=app.logger.name)
+
+    stages = {}
+    for route in ('/deliberate/observables', '/observe/observables'):
+        caplog.clear()
+        response = client.post(route, headers=headers(valid_jwt),
+                               json=valid_json)
+        assert response.status_code == HTTPStatus.OK
+
+        # A lone mapping argument is kept as the args of the log record.
+        timings, = [record.args for record in caplog.records
+                    if record.msg == 'Enrichment stages took %s']
+        assert all(timing >= 0 for timing in timings.values())
+        stages[route] = list(timings)
+
+    assert stages == {
+        '/deliberate/observables': [
+            'normalize', 'lookup', 'extract_verdicts'
+        ],
+        '/observe/observables': [
+            'normalize', 'lookup', 'extract_verdicts', 'extract_judgements',
+            'fetch_details', 'extract_sightings', 'extract_indicators',
+            'extract_relationships'
+        ]
+    }
+    # The deliberate call does not fetch any blocklist details.
+    assert [call[0][0].split('/')[-3] for call in get_mock.call_args_list
+            if 'metadata/' in call[0][0]] == ['badip']
@@ -1,16 +1,41 @@
 from http import HTTPStatus
+from http.client import HTTPMessage
+from time import sleep
 
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
+from aiohttp import ClientPayloadError
+from authlib.jose import jwt
 from pytest import fixture
+from requests import Request
+from requests.cookies import extract_cookies_to_jar
+from requests.exceptions import ChunkedEncodingError
 
-from .utils import headers
+from api.client import get_session
+from api.errors import SERVICE_UNAVAILABLE
+from app import app
+
+from .utils import aiohttp_responses_by_url, headers
 
 
 def routes():
     yield '/health'
 
 
+@fixture(scope='module')
+def success_health_payload():
+    return {
+        'data': {
+            'status': 'ok',
+            'circuit_breakers': {'v2.0/ip': 'closed', 'metadata': 'closed'},
+            'caches': {
+                'metadata': {'hits': 0, 'misses': 0, 'size': 0},
+                'reputation': {'hits': 0, 'misses': 0, 'size': 0}
+            }
+        }
+    }
+
+
 @fixture(scope='module', params=routes(), ids=lambda route: f'POST {route}')
 def route(request):
     return request.param
@@ -34,7 +59,7 @@ def test_health_call_with_invalid_jwt_failure(
     assert response.json == invalid_jwt_expected_payload
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_health_call_with_unauthorized_creds_failure(
         get_mock, route, client, valid_jwt,
         auth0_signals_response_unauthorized_creds,
@@ -50,19 +75,19 @@ def test_health_call_with_unauthorized_creds_failure(
     assert response.json == unauthorized_creds_expected_payload
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_health_call_success(
         get_mock, route, client, valid_jwt,
-        auth0_signals_health_check
+        auth0_signals_health_check, success_health_payload
 ):
     get_mock.return_value = auth0_signals_health_check
     response = client.post(route, headers=headers(valid_jwt))
 
     assert response.status_code == HTTPStatus.OK
-    assert response.json == {'data': {'status': 'ok'}}
+    assert response.json == success_health_payload
 
 
-@patch('requests.get')
+@patch('requests.Session.get')
 def test_health_with_ssl_error(
         mock_request, route, client, valid_jwt,
         auth0_ssl_exception_mock,
@@ -78,3 +103,174 @@ def test_health_with_ssl_error(
 
     response = response.get_json()
     assert response == ssl_error_expected_payload
+
+
+@patch('requests.Session.get')
+def test_health_call_reuses_pooled_session(
+        get_mock, route, client, valid_jwt,
+        auth0_signals_health_check
+):
+    get_mock.return_value = auth0_signals_health_check
+    client.post(route, headers=headers(valid_jwt))
+
+    with patch('requests.Session.__init__', return_value=None) as init_mock:
+        response = client.post(route, headers=headers(valid_jwt))
+        assert response.status_code == HTTPStatus.OK
+
+    init_mock.assert_not_called()
+    for call in get_mock.call_args_list:
+        assert call[1]['headers'] == {'X-Auth-Token': 'test_api_key'}
+
+
+def test_pooled_session_keeps_no_cookies():
+    message = HTTPMessage()
+    message['Set-Cookie'] = 'affinity=node-1; Path=/'
+    response = MagicMock(_original_response=MagicMock(msg=message))
+    request = Request('GET', f"{app.config['API_URL']}v2.0/ip").prepare()
+
+    with app.app_context():
+        session = get_session()
+        extract_cookies_to_jar(session.cookies, request, response)
+
+    assert not session.cookies
+
+
+@patch('aiohttp.ClientSession.get')
+def test_health_call_with_async_engine(
+        async_get_mock, route, client, valid_jwt,
+        auth0_signals_health_check, auth0_signals_response_unauthorized_creds,
+        unauthorized_creds_expected_payload, success_health_payload,
+        monkeypatch
+):
+    monkeypatch.setitem(app.config, 'CLIENT_ENGINE', 'async')
+
+    async_get_mock.side_effect = aiohttp_responses_by_url(
+        {'v2.0/ip': auth0_signals_health_check}
+    )
+    response = client.post(route, headers=headers(valid_jwt))
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == success_health_payload
+
+    async_get_mock.side_effect = aiohttp_responses_by_url(
+        {'v2.0/ip': auth0_signals_response_unauthorized_creds}
+    )
+    response = client.post(route, headers=headers(valid_jwt))
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == unauthorized_creds_expected_payload
+
+
+@patch('requests.Session.get')
+def test_health_call_with_open_circuit_breaker(
+        get_mock, route, client, valid_jwt, auth0_signals_health_check,
+        success_health_payload, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 0)
+    monkeypatch.setitem(app.config, 'CIRCUIT_BREAKER_MIN_CALLS', 2)
+    monkeypatch.setitem(app.config, 'CIRCUIT_BREAKER_RESET_TIMEOUT', 0.1)
+    get_mock.return_value = MagicMock(
+        ok=False, status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        reason='Service Unavailable', text='Service Unavailable', headers={}
+    )
+
+    for _ in range(2):
+        response = client.post(route, headers=headers(valid_jwt))
+        assert response.json['errors'][0]['code'] == 'service unavailable'
+
+    response = client.post(route, headers=headers(valid_jwt))
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {
+        'data': {},
+        'errors': [
+            {'code': SERVICE_UNAVAILABLE,
+             'message': 'Auth0 Signals v2.0/ip endpoint is temporarily '
+                        'unavailable. Try again later.',
+             'type': 'fatal'}
+        ]
+    }
+    assert get_mock.call_count == 2
+
+    # The probe call made once the reset timeout is over closes it again.
+    sleep(0.1)
+    get_mock.return_value = auth0_signals_health_check
+    response = client.post(route, headers=headers(valid_jwt))
+
+    assert response.json == success_health_payload
+    assert get_mock.call_count == 3
+
+
+@patch('aiohttp.ClientSession.get')
+@patch('requests.Session.get')
+def test_health_call_recovers_from_a_probe_failing_unexpectedly(
+        get_mock, async_get_mock, route, client, valid_jwt,
+        auth0_signals_health_check, success_health_payload, monkeypatch
+):
+    monkeypatch.setitem(app.config, 'HTTP_RETRIES', 0)
+    monkeypatch.setitem(app.config, 'CIRCUIT_BREAKER_MIN_CALLS', 1)
+    monkeypatch.setitem(app.config, 'CIRCUIT_BREAKER_RESET_TIMEOUT', 0.1)
+
+    service_unavailable = MagicMock(
+        ok=False, status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        reason='Service Unavailable', text='Service Unavailable', headers={}
+    )
+
+    for engine, error in (('sync', ChunkedEncodingError()),
+                          ('async', ClientPayloadError())):
+        monkeypatch.setitem(app.config, 'CLIENT_ENGINE', engine)
+        # A server error opens the breaker, then the probe let through once
+        # the reset timeout is over fails with an unexpected error.
+        for upstream_response in (service_unavailable, error):
+            get_mock.side_effect = [upstream_response]
+            async_get_mock.side_effect = aiohttp_responses_by_url(
+                {'v2.0/ip': upstream_response}
+            )
+            client.post(route, headers=headers(valid_jwt))
+            sleep(0.1)
+
+        get_mock.side_effect = None
+        get_mock.return_value = auth0_signals_health_check
+        async_get_mock.side_effect = aiohttp_responses_by_url(
+            {'v2.0/ip': auth0_signals_health_check}
+        )
+        response = client.post(route, headers=headers(valid_jwt))
+
+        assert response.status_code == HTTPStatus.OK
+        assert response.json == success_health_payload
+
+
+@patch('requests.Session.get')
+def test_health_call_reports_cache_stats(
+        get_mock, route, client, valid_jwt, auth0_signals_health_check,
+        auth0_signals_response_ok
+):
+    get_mock.return_value = auth0_signals_response_ok
+    for _ in range(2):
+        client.post('/deliberate/observables', headers=headers(valid_jwt),
+                    json=[{'type': 'ip', 'value': '1.1.1.1'}])
+
+    get_mock.return_value = auth0_signals_health_check
+    response = client.post(route, headers=headers(valid_jwt))
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json['data']['caches'] == {
+        'metadata': {'hits': 0, 'misses': 0, 'size': 0},
+        'reputation': {'hits': 1, 'misses': 1, 'size': 1}
+    }
+
+
+@patch('requests.Session.get')
+def test_health_call_verifies_reused_jwt_once(
+        get_mock, route, client, valid_jwt, auth0_signals_health_check,
+        capsys
+):
+    get_mock.return_value = auth0_signals_health_check
+
+    with patch.object(jwt, 'decode', wraps=jwt.decode) as decode_mock:
+        for _ in range(2):
+            response = client.post(route, headers=headers(valid_jwt))
+            assert response.status_code == HTTPStatus.OK
+
+    decode_mock.assert_called_once()
+    for call in get_mock.call_args_list:
+        assert call[1]['headers'] == {'X-Auth-Token': 'test_api_key'}
+    assert 'test_api_key' not in capsys.readouterr().out
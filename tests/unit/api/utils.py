@@ -1,2 +1,68 @@
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+
 def headers(jwt):
     return {'Authorization': f'Bearer {jwt}'}
+
+
+def responses_by_url(responses):
+    """
+    Build a side effect answering each upstream URL with the mock registered
+    for the first matching part of the URL, regardless of the call order.
+    """
+
+    def side_effect(url, *args, **kwargs):
+        for part, response in responses.items():
+            if part in url:
+                return response
+        raise AssertionError(f'Unexpected upstream call: {url}')
+
+    return side_effect
+
+
+class AsyncContextManager:
+    # MagicMock only supports the asynchronous protocols from Python 3.8.
+    def __init__(self, value, delay=0):
+        self.value = value
+        self.delay = delay
+
+    async def __aenter__(self):
+        await asyncio.sleep(self.delay)
+        return self.value
+
+    async def __aexit__(self, *args):
+        return False
+
+
+async def resolve(value):
+    return value
+
+
+def aiohttp_responses_by_url(responses, delay=0):
+    """
+    Same as `responses_by_url`, but answering with aiohttp-like responses
+    built from the requests-like mocks, after the delay if any.
+    """
+
+    requests_side_effect = responses_by_url(responses)
+
+    def side_effect(url, *args, **kwargs):
+        response = requests_side_effect(url)
+        if isinstance(response, Exception):
+            raise response
+
+        if response.ok:
+            status, text = response.status, json.dumps(response.json())
+        else:
+            status, text = response.status_code, response.text
+
+        aiohttp_response = MagicMock(
+            status=status, reason=response.reason, headers=response.headers
+        )
+        aiohttp_response.text = lambda: resolve(text)
+
+        return AsyncContextManager(aiohttp_response, delay)
+
+    return side_effect
@@ -1,15 +1,34 @@
+import json
 from datetime import datetime
 from http import HTTPStatus
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, PropertyMock
 from requests.exceptions import SSLError
 
 from authlib.jose import jwt
 from pytest import fixture
 
+from api.cache import clear_caches
 from api.errors import INVALID_ARGUMENT, AUTH_ERROR
+from api.resilience import (
+    clear_circuit_breakers, clear_hedgers, clear_token_buckets
+)
 from app import app
 
 
+@fixture(autouse=True)
+def process_caches():
+    # Keep the process-wide caches from leaking between the tests.
+    clear_caches()
+    clear_token_buckets()
+    clear_circuit_breakers()
+    clear_hedgers()
+    yield
+    clear_caches()
+    clear_token_buckets()
+    clear_circuit_breakers()
+    clear_hedgers()
+
+
 @fixture(scope='session')
 def secret_key():
     # Generate some string based on the current datetime.
@@ -167,10 +186,15 @@ def auth0_signals_api_response_mock(status_code, payload=None):
 
     mock_response.status = status_code
     mock_response.ok = status_code == HTTPStatus.OK
+    mock_response.headers = {}
 
     payload = payload or {}
 
     mock_response.json = lambda: payload
+    # The raw body follows the parsed one, even when a test replaces it.
+    type(mock_response).content = PropertyMock(
+        side_effect=lambda: json.dumps(mock_response.json()).encode()
+    )
 
     return mock_response
 
@@ -180,6 +204,7 @@ def auth0_signals_api_error_mock(status_code, text=None, reason=None):
 
     mock_response.status_code = status_code
     mock_response.ok = status_code == HTTPStatus.OK
+    mock_response.headers = {}
 
     mock_response.text = text
     mock_response.reason = reason
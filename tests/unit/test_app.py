@@ -1,8 +1,17 @@
+import os
 from collections import namedtuple
 from http import HTTPStatus
 
 from pytest import fixture
 
+from benchmarks.imports import profile_import
+
+
+# The import time budget of the application in milliseconds, which may be
+# raised on slower machines.
+IMPORT_TIME_BUDGET = float(os.environ.get('IMPORT_TIME_BUDGET', 400))
+
+LAZY_MODULES = ('aiohttp', 'asyncio', 'authlib', 'marshmallow', 'requests')
 
 Call = namedtuple('Call', ('method', 'route', 'expected_status_code'))
 
@@ -31,3 +40,14 @@ def call(request):
 def test_non_relay_call_failure(call, client):
     response = client.open(call.route, method=call.method)
     assert response.status_code == call.expected_status_code
+
+
+def test_app_import_stays_within_budget():
+    # The best of a few runs, so a busy machine does not fail it.
+    profiles = [profile_import('app') for _ in range(3)]
+    total, timings = min(profiles)
+
+    assert total / 1000 <= IMPORT_TIME_BUDGET
+    # The heavy dependencies are only loaded on first use.
+    assert not {name.split('.')[0] for name, _, _ in timings} & \
+        set(LAZY_MODULES)